@@ -0,0 +1,403 @@
+import heapq
+import syntax
+
+# worklist abstract interpretation over the basic blocks of one function.
+# every 8-bit register holds an interval (lo, hi), a constant being lo == hi,
+# next to the selected ROM bank (as written to the MBC at $2000-$3FFF) and the
+# register the Z flag currently tells about, so conditional edges can refine it.
+
+REGS = ("A", "B", "C", "D", "E", "H", "L")
+IDX = {reg: i for i, reg in enumerate(REGS)}
+BANK = len(REGS)
+ZREG = BANK + 1
+
+TOP = (0, 0xFF)
+BANK_TOP = (0, 0x1FF)
+MBC_BANK_SELECT = range(0x2000, 0x4000)
+
+# visits of a loop head before its state is widened
+WIDEN_DELAY = 2
+# block evaluations per function before giving up on a fixed point
+MAX_STEPS = 10000
+
+
+def top_state():
+    return (TOP,) * len(REGS) + (BANK_TOP, None)
+
+def const(v):
+    return (v & 0xFF, v & 0xFF)
+
+def is_const(iv):
+    return iv[0] == iv[1]
+
+def join_iv(a, b):
+    return (min(a[0], b[0]), max(a[1], b[1]))
+
+def widen_iv(old, new, top=TOP):
+    # bounds that are still moving go straight to the end of the domain
+    return (old[0] if new[0] >= old[0] else top[0], old[1] if new[1] <= old[1] else top[1])
+
+def add_iv(a, b):
+    lo, hi = a[0] + b[0], a[1] + b[1]
+    if hi <= 0xFF:
+        return (lo, hi)
+    return (lo - 0x100, hi - 0x100) if lo > 0xFF else TOP
+
+def sub_iv(a, b):
+    lo, hi = a[0] - b[1], a[1] - b[0]
+    if lo >= 0:
+        return (lo, hi)
+    return (lo + 0x100, hi + 0x100) if hi < 0 else TOP
+
+def join(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    regs = tuple(join_iv(x, y) for x, y in zip(a[:ZREG], b[:ZREG]))
+    return regs + (a[ZREG] if a[ZREG] == b[ZREG] else None,)
+
+def widen(old, new):
+    if old is None or new is None:
+        return new
+    regs = tuple(widen_iv(x, y) for x, y in zip(old[:BANK], new[:BANK]))
+    return regs + (widen_iv(old[BANK], new[BANK], BANK_TOP), new[ZREG])
+
+
+# written registers of every instruction, used for clobbering and by callers
+# that need to know what a piece of code may change
+def written_regs(inst):
+    t = type(inst)
+    if t in {syntax.InstCall, syntax.InstConitionalCall, syntax.InstReset}:
+        return set(REGS)
+    if t in {syntax.InstALU, syntax.InstALUDirect, syntax.InstALUImmediate}:
+        return set() if inst.op in {"CP", "SCF", "CCF"} else {"A"}
+    if t in {syntax.InstHighStore, syntax.InstHighCStore}:
+        return {"A"} if "load" in inst.op or inst.op.endswith("(C)") else set()
+    if t in {syntax.InstLoadImmediate16bit, syntax.InstIncDec16bit, syntax.InstALU16bit}:
+        return set(syntax.reg_pair(inst.regl) or [])
+    if t in {syntax.InstPop}:
+        return {inst.regl, inst.regr} & set(REGS)
+    if t in {syntax.InstLoadRegToHLI, syntax.InstLoadHLIToReg}:
+        return {"H", "L"} | ({inst.regl} & set(REGS))
+    if t == syntax.InstCBPrefix:
+        return set() if 8 <= int(inst.op[1:]) < 16 else {inst.regl}
+    if t in {syntax.InstIncDec, syntax.InstLoadImmediate, syntax.InstLoadRegToReg,
+             syntax.InstLoadHLToReg, syntax.InstLoadAddr, syntax.InstLoad16bit,
+             syntax.InstLoadDirect, syntax.InstHighLoad, syntax.InstHighCLoad}:
+        return {inst.regl} & set(REGS)
+    return set()
+
+
+def transfer(inst, s):
+    # applies inst to the state list s in place
+    t = type(inst)
+    if t == syntax.InstLoadImmediate:
+        if inst.regl in IDX:
+            s[IDX[inst.regl]] = const(inst.imm)
+            overwrite(s, {inst.regl})
+    elif t == syntax.InstLoadRegToReg:
+        s[IDX[inst.regl]] = s[IDX[inst.regr]]
+        overwrite(s, {inst.regl})
+    elif t == syntax.InstLoadImmediate16bit:
+        pair = syntax.reg_pair(inst.regl)
+        if pair:
+            s[IDX[pair[0]]] = const(inst.imm >> 8)
+            s[IDX[pair[1]]] = const(inst.imm)
+            overwrite(s, pair)
+    elif t == syntax.InstIncDec:
+        i = IDX[inst.regl]
+        s[i] = add_iv(s[i], (1, 1)) if inst.op.upper() == "INC" else sub_iv(s[i], (1, 1))
+        s[ZREG] = inst.regl
+    elif t == syntax.InstIncDec16bit:
+        pair = syntax.reg_pair(inst.regl)
+        if pair:
+            hi, lo = IDX[pair[0]], IDX[pair[1]]
+            if is_const(s[hi]) and is_const(s[lo]):
+                v = (s[hi][0] << 8 | s[lo][0]) + (1 if inst.op.upper() == "INC" else -1)
+                s[hi], s[lo] = const(v >> 8), const(v)
+            else:
+                s[hi] = s[lo] = TOP
+            overwrite(s, pair)
+    elif t in {syntax.InstALU, syntax.InstALUImmediate, syntax.InstALUDirect}:
+        alu(inst, s)
+    elif t in {syntax.InstStoreAddr, syntax.InstLoadRegToHL}:
+        addr = inst.addr if t == syntax.InstStoreAddr else hl(s)
+        if addr is not None and addr in MBC_BANK_SELECT:
+            s[BANK] = s[IDX[inst.regr]]
+    elif t == syntax.InstLoadImmediateDirect:
+        addr = hl(s)
+        if addr is not None and addr in MBC_BANK_SELECT:
+            s[BANK] = const(inst.imm)
+    elif t in {syntax.InstCall, syntax.InstConitionalCall, syntax.InstReset}:
+        # the callee may leave anything behind, including another bank
+        for i in range(len(REGS)):
+            s[i] = TOP
+        s[BANK] = BANK_TOP
+        s[ZREG] = None
+    else:
+        regs = written_regs(inst)
+        for reg in regs:
+            s[IDX[reg]] = TOP
+        overwrite(s, regs)
+        if t in {syntax.InstCBPrefix, syntax.InstCBPrefixDirect, syntax.InstIncDecDirect, syntax.InstPop}:
+            s[ZREG] = None
+
+def overwrite(s, regs):
+    # the zero flag no longer tells anything about a register written
+    # by an instruction that leaves the flags alone
+    if s[ZREG] in regs:
+        s[ZREG] = None
+
+def hl(s):
+    h, l = s[IDX["H"]], s[IDX["L"]]
+    return h[0] << 8 | l[0] if is_const(h) and is_const(l) else None
+
+def alu(inst, s):
+    a = s[IDX["A"]]
+    op = inst.op
+    if type(inst) == syntax.InstALU and op not in syntax.ALU_SYMBOLS and op != "CP":
+        # RLCA, CPL, DAA, SCF, ... change A or just the flags
+        if op not in {"SCF", "CCF"}:
+            s[IDX["A"]] = TOP
+        s[ZREG] = None
+        return
+    if type(inst) == syntax.InstALU:
+        b = s[IDX[inst.regr]]
+    elif type(inst) == syntax.InstALUImmediate:
+        b = const(inst.imm)
+    else:
+        b = TOP
+
+    if op == "CP":
+        s[ZREG] = "A" if b == (0, 0) else None
+        return
+    if op in {"XOR", "SUB"} and type(inst) == syntax.InstALU and inst.regr == "A":
+        res = (0, 0)
+    elif op == "ADD":
+        res = add_iv(a, b)
+    elif op == "ADC":
+        res = add_iv(add_iv(a, b), (0, 1))
+    elif op == "SUB":
+        res = sub_iv(a, b)
+    elif op == "SBC":
+        res = sub_iv(sub_iv(a, b), (0, 1))
+    elif op == "AND":
+        res = (0, min(a[1], b[1]))
+        if is_const(a) and is_const(b):
+            res = const(a[0] & b[0])
+    elif is_const(a) and is_const(b):
+        res = const(a[0] | b[0] if op == "OR" else a[0] ^ b[0])
+    elif op == "OR":
+        res = (max(a[0], b[0]), 0xFF)
+    else:
+        res = TOP
+    s[IDX["A"]] = res
+    s[ZREG] = "A"
+
+
+def refine(state, cond, taken):
+    # the state on an edge that is only followed when cond is (not) met
+    if state is None or state[ZREG] is None or cond not in {"Z", "NZ"}:
+        return state
+    zero = (cond == "Z") == taken
+    i = IDX[state[ZREG]]
+    lo, hi = state[i]
+    if zero:
+        if lo > 0:
+            return None
+        iv = (0, 0)
+    else:
+        if hi == 0:
+            return None
+        iv = (1 if lo == 0 else lo, hi)
+    return state[:i] + (iv,) + state[i+1:]
+
+
+JUMPS = {syntax.InstRelJump, syntax.InstAbsJump}
+COND_JUMPS = {syntax.InstRelJumpConditional, syntax.InstAbsJumpConditional}
+
+def jump_target(inst, pc):
+    if type(inst) in {syntax.InstRelJump, syntax.InstRelJumpConditional}:
+        return pc + 2 + inst.addr
+    return inst.addr
+
+
+class Block:
+    def __init__(self, lo, hi):
+        # instructions slice[lo:hi]
+        self.lo = lo
+        self.hi = hi
+        # [(block index, cond, taken)], cond None for plain fall through / jumps
+        self.succs = []
+        # (lo, hi) clock cycles, set by cycles.annotate_blocks
+        self.cycles = None
+
+
+def basic_blocks(slice):
+    # splits [(inst, pc)] (sorted by pc) into blocks with their successors
+    if not slice:
+        return []
+    index = {pc: i for i, (_, pc) in enumerate(slice)}
+    leaders = {0}
+    for i, (inst, pc) in enumerate(slice):
+        t = type(inst)
+        if t in JUMPS or t in COND_JUMPS:
+            target = index.get(jump_target(inst, pc))
+            if target is not None:
+                leaders.add(target)
+        if t in JUMPS or t in COND_JUMPS or t in {syntax.InstRet, syntax.InstConitionalRet}:
+            leaders.add(i + 1)
+    leaders = sorted(l for l in leaders if l < len(slice))
+    blocks = [Block(lo, hi) for lo, hi in zip(leaders, leaders[1:] + [len(slice)])]
+    block_of = {b.lo: n for n, b in enumerate(blocks)}
+
+    for n, b in enumerate(blocks):
+        inst, pc = slice[b.hi - 1]
+        t = type(inst)
+        nxt = n + 1 if n + 1 < len(blocks) else None
+        target = block_of.get(index.get(jump_target(inst, pc), -1)) if t in JUMPS or t in COND_JUMPS else None
+        if t in JUMPS:
+            if target is not None:
+                b.succs.append((target, None, True))
+        elif t in COND_JUMPS:
+            if target is not None:
+                b.succs.append((target, inst.cond, True))
+            if nxt is not None:
+                b.succs.append((nxt, inst.cond, False))
+        elif t == syntax.InstRet:
+            pass
+        elif t == syntax.InstConitionalRet:
+            if nxt is not None:
+                b.succs.append((nxt, inst.cond, False))
+        elif nxt is not None:
+            b.succs.append((nxt, None, True))
+    return blocks
+
+
+class FunctionAnalysis:
+    def __init__(self, slice, entry=None, max_steps=MAX_STEPS):
+        self.slice = slice
+        self.entry = entry if entry is not None else top_state()
+        self.max_steps = max_steps
+        self.blocks = basic_blocks(slice)
+        self.index = {pc: i for i, (_, pc) in enumerate(slice)}
+        self.block_at = {}
+        for n, b in enumerate(self.blocks):
+            for i in range(b.lo, b.hi):
+                self.block_at[slice[i][1]] = n
+        self.loop_heads = {succ for n, b in enumerate(self.blocks) for succ, _, _ in b.succs if succ <= n}
+        self.states = {}
+        self.steps = 0
+        self.converged = None
+        self._cache = {}
+
+    def block_transfer(self, n, state):
+        # cached: the same block entered with the same state gives the same result
+        key = (n, state)
+        if key not in self._cache:
+            s = list(state)
+            b = self.blocks[n]
+            for inst, _ in self.slice[b.lo:b.hi]:
+                transfer(inst, s)
+            self._cache[key] = tuple(s)
+        return self._cache[key]
+
+    def run(self):
+        if not self.blocks:
+            self.converged = True
+            return self
+        visits = {}
+        self.states = {0: self.entry}
+        worklist = [0]
+        queued = {0}
+        while worklist:
+            if self.steps >= self.max_steps:
+                # out of budget: fall back to knowing nothing, which is sound
+                self.states = {n: top_state() for n in range(len(self.blocks))}
+                self.converged = False
+                return self
+            n = heapq.heappop(worklist)
+            queued.discard(n)
+            self.steps += 1
+            out = self.block_transfer(n, self.states[n])
+            for succ, cond, taken in self.blocks[n].succs:
+                edge = refine(out, cond, taken) if cond else out
+                if edge is None:
+                    continue
+                old = self.states.get(succ)
+                new = join(old, edge)
+                if succ in self.loop_heads:
+                    visits[succ] = visits.get(succ, 0) + 1
+                    if visits[succ] > WIDEN_DELAY:
+                        new = widen(old, new)
+                if new != old:
+                    self.states[succ] = new
+                    if succ not in queued:
+                        heapq.heappush(worklist, succ)
+                        queued.add(succ)
+        self.converged = True
+        return self
+
+    def state_before(self, pc):
+        n = self.block_at.get(pc)
+        if n is None or n not in self.states:
+            return None
+        s = list(self.states[n])
+        b = self.blocks[n]
+        for inst, ipc in self.slice[b.lo:b.hi]:
+            if ipc == pc:
+                return tuple(s)
+            transfer(inst, s)
+        return None
+
+    def state_after(self, pc):
+        # the state falling through the instruction at pc
+        state = self.state_before(pc)
+        if state is None:
+            return None
+        inst = self.slice[self.index[pc]][0]
+        s = list(state)
+        transfer(inst, s)
+        if type(inst) in COND_JUMPS or type(inst) == syntax.InstConitionalRet:
+            return refine(tuple(s), inst.cond, False)
+        return tuple(s)
+
+
+def entry_state(regmap):
+    # registers holding known numbers in a dry run regmap start out constant
+    s = list(top_state())
+    for reg in REGS:
+        if type(regmap.get(reg)) == int:
+            s[IDX[reg]] = const(regmap[reg])
+    return tuple(s)
+
+
+def describe(state, reg):
+    # the value of reg as regmap text when it is known, None otherwise
+    if state is None:
+        return None
+    iv = state[IDX[reg]]
+    return f"${iv[0]:02x}" if is_const(iv) else None
+
+
+def flatten(content):
+    # explored IF/LOOP blocks back to a flat [(inst, pc)], sorted by pc
+    res = []
+    stack = [content]
+    while stack:
+        for inst, pc in stack.pop():
+            if type(inst) is not dict:
+                res.append((inst, pc))
+            else:
+                res.append((inst["inst"], inst.get("end", inst["pc"])))
+                stack.append(inst["content"])
+    res.sort(key=lambda item: item[1])
+    return res
+
+
+def content_writes(content):
+    regs = set()
+    for inst, _ in flatten(content):
+        regs |= written_regs(inst)
+    return regs
@@ -0,0 +1,92 @@
+import sys
+from collections import OrderedDict
+from lexer import BANK_SIZE, tokenize_range
+
+# a drop-in replacement for the tokens dict of tokenize_code that keeps only
+# as many decoded banks alive as fit in a memory budget. evicted banks are
+# decoded again, transparently, the next time they are touched.
+
+
+def bank_size(tokens):
+    # rough footprint of a decoded bank: the dict plus every instruction object
+    return sys.getsizeof(tokens) + sum(sys.getsizeof(inst) + sys.getsizeof(vars(inst))
+                                       for inst in tokens.values())
+
+
+class BankedTokens:
+    def __init__(self, code, max_bytes=None):
+        self.code = code
+        self.max_bytes = max_bytes
+        self.banks = OrderedDict()
+        self.sizes = {}
+        self.used = 0
+        self.decodes = 0
+
+        # one pass in order to learn where decoding enters every bank, an
+        # instruction may run over a bank boundary
+        self.entries = []
+        self.counts = []
+        pc = 0
+        for bank in range((len(code) + BANK_SIZE - 1) // BANK_SIZE):
+            self.entries.append(pc)
+            tokens, pc = self._decode(bank)
+            self.counts.append(len(tokens))
+            self._insert(bank, tokens)
+
+    def _decode(self, bank):
+        # returns the bank's tokens and the pc after its last instruction
+        end = min((bank + 1) * BANK_SIZE, len(self.code))
+        tokens, next_pc = tokenize_range(self.code, self.entries[bank], end)
+        self.decodes += 1
+        return dict(tokens), next_pc
+
+    def _insert(self, bank, tokens):
+        size = bank_size(tokens)
+        self.banks[bank] = tokens
+        self.sizes[bank] = size
+        self.used += size
+        # the bank just inserted always stays, even over budget
+        while self.max_bytes is not None and self.used > self.max_bytes and len(self.banks) > 1:
+            evicted, _ = self.banks.popitem(last=False)
+            self.used -= self.sizes.pop(evicted)
+
+    def bank(self, bank):
+        tokens = self.banks.get(bank)
+        if tokens is None:
+            tokens, _ = self._decode(bank)
+            self._insert(bank, tokens)
+        else:
+            self.banks.move_to_end(bank)
+        return tokens
+
+    def get(self, pc, default=None):
+        if pc < 0 or pc >= len(self.code):
+            return default
+        return self.bank(pc // BANK_SIZE).get(pc, default)
+
+    def __getitem__(self, pc):
+        tok = self.get(pc)
+        if tok is None:
+            raise KeyError(pc)
+        return tok
+
+    def __contains__(self, pc):
+        return self.get(pc) is not None
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def items(self):
+        for bank in range(len(self.entries)):
+            yield from self.bank(bank).items()
+
+    def keys(self):
+        for pc, _ in self.items():
+            yield pc
+
+    def values(self):
+        for _, inst in self.items():
+            yield inst
+
+    def __iter__(self):
+        return self.keys()
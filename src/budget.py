@@ -0,0 +1,69 @@
+import time
+
+# step and wall time limits of an analysis. a Budget covers a whole ROM and
+# hands out one per function with func(), every step taken by a function
+# budget is charged to the ROM one as well. None means no limit.
+# a step is one unit of work: a byte scanned, an instruction structured or
+# dry run, a block transferred by the abstract interpreter.
+
+# how many steps go by between two looks at the clock
+CLOCK_EVERY = 256
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class Budget:
+    def __init__(self, steps=None, seconds=None, func_steps=None, func_seconds=None, parent=None):
+        self.steps = steps
+        self.seconds = seconds
+        self.func_steps = func_steps
+        self.func_seconds = func_seconds
+        self.parent = parent
+        self.used = 0
+        self.started = None
+        self.spent = 0.0
+        self.exceeded = None
+
+    def func(self):
+        return Budget(self.func_steps, self.func_seconds, parent=self)
+
+    def pause(self):
+        # stops the clock until the next step, e.g. while a function waits
+        # for its callees to be explored under budgets of their own
+        if self.started is not None:
+            self.spent += time.monotonic() - self.started
+            self.started = None
+
+    def step(self, n=1):
+        # raises BudgetExceeded once this budget or one it is charged to runs out
+        if self.exceeded:
+            raise BudgetExceeded(self.exceeded)
+        if self.started is None:
+            self.started = time.monotonic()
+        before = self.used
+        self.used += n
+        if self.steps is not None and self.used > self.steps:
+            self.exceeded = f"over {self.steps} steps"
+        elif self.seconds is not None and (before // CLOCK_EVERY != self.used // CLOCK_EVERY or n > 1) \
+             and self.spent + time.monotonic() - self.started > self.seconds:
+            self.exceeded = f"over {self.seconds} seconds"
+        if self.parent is not None:
+            try:
+                self.parent.step(n)
+            except BudgetExceeded:
+                self.exceeded = self.parent.exceeded
+        if self.exceeded:
+            raise BudgetExceeded(self.exceeded)
+
+    @property
+    def exhausted(self):
+        # the budget itself or the one it is charged to ran out
+        return bool(self.exceeded) or (self.parent is not None and self.parent.exhausted)
+
+
+def charge(budget, n=1):
+    # for code paths where the budget is optional
+    if budget is not None:
+        budget.step(n)
@@ -0,0 +1,251 @@
+import sys
+import time
+import json
+import random
+import argparse
+import syntax
+import lexer
+from lr35902dis import lr35902 as ref
+
+# differential check of lexer.consume against the lr35902dis decoder.
+# both sides are reduced to (length, mnemonic, operands) with operands
+# written the same way, e.g. ("LD", ("[$C0A0]", "A")) or ("JR", ("NZ", "$0105")).
+
+ALU_OPS = set(lexer.OP_ORDER)
+
+REF_CONDS = {
+    ref.CC.NOT_Z: "NZ",
+    ref.CC.Z: "Z",
+    ref.CC.NOT_C: "NC",
+    ref.CC.C: "C",
+}
+
+# operand bytes that are not operands, e.g. the padding byte of STOP
+REF_IGNORED = {"STOP"}
+
+
+def ref_operand(oper_type, val):
+    T = ref.OPER_TYPE
+    if oper_type == T.REG:
+        return val.name
+    if oper_type == T.REG_DEREF:
+        return f"[{val.name}]"
+    if oper_type == T.REG_DEREF_INC:
+        return "[HL+]"
+    if oper_type == T.REG_DEREF_DEC:
+        return "[HL-]"
+    if oper_type == T.REG_DEREF_FF00:
+        return f"[$FF00+{val.name}]"
+    if oper_type == T.ADDR:
+        return f"${val & 0xFFFF:04X}"
+    if oper_type == T.ADDR_DEREF:
+        return f"[${val:04X}]"
+    if oper_type == T.ADDR_DEREF_FF00:
+        return f"[$FF{val:02X}]"
+    if oper_type == T.IMM:
+        return f"${val:X}"
+    if oper_type == T.SP_OFFSET:
+        return f"SP{val:+d}"
+    if oper_type == T.COND:
+        return REF_CONDS.get(val)
+    raise ValueError(f"unknown operand type {oper_type}")
+
+
+def ref_decode(data, pc):
+    # returns (length, mnemonic, operands), or None for an invalid opcode
+    decoded = ref.decode(bytes(data), pc)
+    if decoded.status != ref.DECODE_STATUS.OK:
+        return None
+    mnemonic = decoded.op.name
+    if mnemonic in {"LDI", "LDD"}:
+        mnemonic = "LD"
+    operands = [ref_operand(*oper) for oper in decoded.operands]
+    operands = [o for o in operands if o is not None]
+    if mnemonic in REF_IGNORED:
+        operands = []
+    if mnemonic in ALU_OPS and len(operands) == 2 and operands[0] == "A":
+        # "ADD A, B" and "SUB B" are the same form for our purposes
+        operands = operands[1:]
+    return decoded.len, mnemonic, tuple(operands)
+
+
+def deref(reg):
+    # the lexer already names (HL) as "[HL]" in its register tables
+    return reg if reg.startswith("[") else f"[{reg}]"
+
+
+def our_operands(inst, pc):
+    t = type(inst)
+    if isinstance(inst, syntax.InstFamilyOpOnly):
+        return []
+    if t in {syntax.InstRelJump, syntax.InstRelJumpConditional}:
+        target = f"${(pc + 2 + inst.addr) & 0xFFFF:04X}"
+        return [inst.cond, target] if inst.cond else [target]
+    if t == syntax.InstReset:
+        return [f"${inst.imm:X}"]
+    if t == syntax.InstConitionalRet:
+        return [inst.cond]
+    if t == syntax.InstALU:
+        return [inst.regr] if inst.op in ALU_OPS else []
+    if t == syntax.InstALUDirect:
+        return [deref(inst.regr)]
+    if t == syntax.InstALUImmediate:
+        return [f"${inst.imm:X}"]
+    if t == syntax.InstHighStore:
+        return [f"[$FF{inst.addr:02X}]", inst.regr]
+    if t in {syntax.InstPush, syntax.InstPop}:
+        return [inst.regl + inst.regr]
+    if t == syntax.InstLoadImmediateDirect:
+        return [deref(inst.regl), f"${inst.imm:X}"]
+    if isinstance(inst, syntax.InstFamilySingleReg):
+        return [inst.regl]
+    if isinstance(inst, syntax.InstFamilyTwoRegs):
+        return [inst.regl, inst.regr]
+    if isinstance(inst, (syntax.InstFamilyRegWithImmediate, syntax.InstFamilyStoreImm)):
+        return [inst.regl, f"${inst.imm:X}"]
+    if isinstance(inst, syntax.InstFamilyAddr):
+        return [f"${inst.addr:04X}"]
+    if isinstance(inst, syntax.InstFamilyDirect):
+        return [deref(inst.regl)]
+    if isinstance(inst, syntax.InstFamilyStoreReg):
+        return [deref(inst.regl), inst.regr]
+    if isinstance(inst, syntax.InstFamilyLoadReg):
+        return [inst.regl, deref(inst.regr)]
+    if isinstance(inst, syntax.InstFamilyStoreAddr):
+        return [f"[${inst.addr:04X}]", inst.regr]
+    if isinstance(inst, syntax.InstFamilyLoadAddr):
+        return [inst.regl, f"[${inst.addr:04X}]"]
+    if isinstance(inst, syntax.InstFamilyCondition):
+        return [inst.cond, f"${inst.addr:04X}"]
+    return []
+
+
+def our_decode(data, pc):
+    # returns (length, mnemonic, operands), or None for an unknown opcode
+    try:
+        inst, rest = lexer.consume(data)
+    except lexer.UnknownInstructionException:
+        return None
+    mnemonic = inst.op.split()[0].upper()
+    if mnemonic == "LDH":
+        mnemonic = "LD"
+    return len(data) - len(rest), mnemonic, tuple(our_operands(inst, pc))
+
+
+def compare(data, pc):
+    # returns a list of (kind, ours, theirs) differences, empty when both agree
+    theirs = ref_decode(data, pc)
+    try:
+        ours = our_decode(data, pc)
+    except Exception as e:
+        return [("error", f"{type(e).__name__}: {e}", theirs)]
+
+    if ours is None or theirs is None:
+        return [] if ours == theirs else [("status", ours, theirs)]
+
+    diffs = []
+    for kind, a, b in zip(("length", "mnemonic", "operands"), ours, theirs):
+        if a != b:
+            diffs.append((kind, a, b))
+    return diffs
+
+
+def opcode_key(data):
+    return f"CB {data[1]:02X}" if data[0] == 0xCB and len(data) > 1 else f"{data[0]:02X}"
+
+
+def check_opcodes(pc=0x150):
+    # every base opcode and every CB sub-opcode, with operand bytes that
+    # are easy to tell apart in the report
+    mismatches = {}
+    for prefix in ((), (0xCB,)):
+        for op in range(256):
+            data = bytes(prefix + (op, 0x34, 0x12, 0x00))
+            for kind, ours, theirs in compare(data, pc):
+                mismatches[f"{opcode_key(data)}: {kind}"] = (ours, theirs)
+    return mismatches
+
+
+def check_stream(code, pc=0):
+    # walks the stream by the reference decoder's lengths and compares both
+    # decoders at every instruction boundary
+    mismatches = {}
+    count = 0
+    view = memoryview(code)
+    while pc < len(code):
+        data = view[pc:pc+4]
+        for kind, ours, theirs in compare(data, pc):
+            mismatches.setdefault(f"{opcode_key(data)}: {kind}", (ours, theirs))
+        decoded = ref.decode(bytes(data), pc)
+        pc += max(decoded.len, 1)
+        count += 1
+    return mismatches, count
+
+
+def ref_tokenize(code):
+    pc = 0
+    tokens = {}
+    while pc < len(code):
+        decoded = ref.decode(code[pc:pc+3], pc)
+        if decoded.status == ref.DECODE_STATUS.OK:
+            tokens[pc] = decoded
+        pc += max(decoded.len, 1)
+    return tokens
+
+
+def throughput(fn, code):
+    start = time.perf_counter()
+    try:
+        fn(code)
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+    return len(code) / (time.perf_counter() - start), None
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="compare lexer.consume against lr35902dis")
+    parser.add_argument("--stream-size", type=int, default=1 << 20, help="bytes of random code to decode")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", help="json file of known mismatches; only new ones fail")
+    parser.add_argument("--save-baseline", help="write the current mismatches as a baseline")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    mismatches = check_opcodes()
+    print(f"opcode table: {len(mismatches)} mismatches over 512 opcodes")
+
+    rng = random.Random(args.seed)
+    stream = bytes(rng.getrandbits(8) for _ in range(args.stream_size))
+    stream_mismatches, count = check_stream(stream)
+    print(f"random stream: {count} instructions, {len(stream_mismatches)} distinct mismatches")
+    for key, val in stream_mismatches.items():
+        mismatches.setdefault(key, val)
+
+    if args.verbose:
+        for key, (ours, theirs) in sorted(mismatches.items()):
+            print(f"\t{key}\n\t\tours:   {ours}\n\t\ttheirs: {theirs}")
+
+    for name, fn in (("lexer", lexer.tokenize_code), ("lr35902dis", ref_tokenize)):
+        rate, err = throughput(fn, stream)
+        if err:
+            print(f"{name:>12}: failed ({err})")
+        else:
+            print(f"{name:>12}: {rate / 1024:.1f} KiB/s")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(sorted(mismatches), f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            known = set(json.load(f))
+        new = sorted(set(mismatches) - known)
+        for key in new:
+            ours, theirs = mismatches[key]
+            print(f"NEW {key}\n\tours:   {ours}\n\ttheirs: {theirs}")
+        return 1 if new else 0
+
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,181 @@
+import sys
+import argparse
+import lexer
+import explorer
+import absint
+
+# static timing of decompiled code, in clock cycles (4 per machine cycle).
+# costs are looked up by the opcode bytes in the ROM image, conditional
+# jumps, calls and returns cost more when taken.
+# estimates are (lo, hi) ranges over the paths through the code, a loop is
+# counted once in the estimate of what contains it and calls are not
+# followed, so they give the cost of one pass through a function's own code.
+
+# a full frame is 70224 cycles, of which VBlank is 10 lines of 456
+VBLANK_CYCLES = 4560
+
+CYCLES = [
+#   x0  x1  x2  x3  x4  x5  x6  x7  x8  x9  xA  xB  xC  xD  xE  xF
+     4, 12,  8,  8,  4,  4,  8,  4, 20,  8,  8,  8,  4,  4,  8,  4,  # 0x
+     4, 12,  8,  8,  4,  4,  8,  4, 12,  8,  8,  8,  4,  4,  8,  4,  # 1x
+    12, 12,  8,  8,  4,  4,  8,  4, 12,  8,  8,  8,  4,  4,  8,  4,  # 2x
+    12, 12,  8,  8, 12, 12, 12,  4, 12,  8,  8,  8,  4,  4,  8,  4,  # 3x
+     4,  4,  4,  4,  4,  4,  8,  4,  4,  4,  4,  4,  4,  4,  8,  4,  # 4x
+     4,  4,  4,  4,  4,  4,  8,  4,  4,  4,  4,  4,  4,  4,  8,  4,  # 5x
+     4,  4,  4,  4,  4,  4,  8,  4,  4,  4,  4,  4,  4,  4,  8,  4,  # 6x
+     8,  8,  8,  8,  8,  8,  4,  8,  4,  4,  4,  4,  4,  4,  8,  4,  # 7x
+     4,  4,  4,  4,  4,  4,  8,  4,  4,  4,  4,  4,  4,  4,  8,  4,  # 8x
+     4,  4,  4,  4,  4,  4,  8,  4,  4,  4,  4,  4,  4,  4,  8,  4,  # 9x
+     4,  4,  4,  4,  4,  4,  8,  4,  4,  4,  4,  4,  4,  4,  8,  4,  # Ax
+     4,  4,  4,  4,  4,  4,  8,  4,  4,  4,  4,  4,  4,  4,  8,  4,  # Bx
+    20, 12, 16, 16, 24, 16,  8, 16, 20, 16, 16,  0, 24, 24,  8, 16,  # Cx
+    20, 12, 16,  0, 24, 16,  8, 16, 20, 16, 16,  0, 24,  0,  8, 16,  # Dx
+    12, 12,  8,  0,  0, 16,  8, 16, 16,  4, 16,  0,  0,  0,  8, 16,  # Ex
+    12, 12,  8,  4,  0, 16,  8, 16, 12,  8, 16,  4,  0,  0,  8, 16,  # Fx
+]
+
+# not taken costs of the conditional instructions, CYCLES holds the taken ones
+NOT_TAKEN = {
+    0x20: 8,  0x28: 8,  0x30: 8,  0x38: 8,    # JR cc
+    0xC2: 12, 0xCA: 12, 0xD2: 12, 0xDA: 12,   # JP cc
+    0xC4: 12, 0xCC: 12, 0xD4: 12, 0xDC: 12,   # CALL cc
+    0xC0: 8,  0xC8: 8,  0xD0: 8,  0xD8: 8,    # RET cc
+}
+
+def cb_cycles(opcode):
+    # CB prefixed, prefix included: [HL] operands cost more, BIT only reads it
+    if opcode & 7 != 6:
+        return 8
+    return 12 if 0x40 <= opcode < 0x80 else 16
+
+# the final RET or RETI of a function, left out of what the explorer returns
+RET_CYCLES = CYCLES[0xC9]
+
+def inst_cycles(code, pc):
+    # (taken, not taken) cost of the instruction at pc, equal for unconditional ones
+    opcode = code[pc]
+    if opcode == 0xCB:
+        cost = cb_cycles(code[pc + 1]) if pc + 1 < len(code) else 8
+        return cost, cost
+    return CYCLES[opcode], NOT_TAKEN.get(opcode, CYCLES[opcode])
+
+def inst_range(code, pc):
+    taken, not_taken = inst_cycles(code, pc)
+    return min(taken, not_taken), max(taken, not_taken)
+
+def format_cycles(cycles):
+    lo, hi = cycles
+    return f"{lo} cycles" if lo == hi else f"{lo}-{hi} cycles"
+
+
+def annotate_blocks(code, slice, blocks=None):
+    # sets .cycles = (lo, hi) on the basic blocks of slice and returns them
+    if blocks is None:
+        blocks = absint.basic_blocks(slice)
+    for b in blocks:
+        lo = hi = 0
+        for _, pc in slice[b.lo:b.hi]:
+            a, z = inst_range(code, pc)
+            lo, hi = lo + a, hi + z
+        b.cycles = (lo, hi)
+    return blocks
+
+
+def content_cycles(code, content):
+    # returns ((lo, hi) of one pass over explored content, {loop end pc: (lo, hi) of one iteration}).
+    # walks nested blocks with an explicit stack of [items, next index, block, lo, hi] frames.
+    loops = {}
+    stack = [[content, 0, None, 0, 0]]
+    while True:
+        frame = stack[-1]
+        items, i, block = frame[0], frame[1], frame[2]
+        if i < len(items):
+            frame[1] += 1
+            inst, pc = items[i]
+            if type(inst) is dict:
+                stack.append([inst["content"], 0, inst, 0, 0])
+            else:
+                lo, hi = inst_range(code, pc)
+                frame[3] += lo
+                frame[4] += hi
+            continue
+        stack.pop()
+        lo, hi = frame[3], frame[4]
+        if block is None:
+            return (lo, hi), loops
+        jump_pc = block.get("end", block["pc"])
+        taken, not_taken = inst_cycles(code, jump_pc)
+        if block["type"].upper() == "LOOP":
+            loops[jump_pc] = (lo + taken, hi + taken)
+            lo, hi = lo + min(taken, not_taken), hi + max(taken, not_taken)
+        elif taken == not_taken:
+            # an unconditional jump over the block, it never runs
+            lo = hi = taken
+        else:
+            lo, hi = min(taken, not_taken + lo), max(taken, not_taken + hi)
+        stack[-1][3] += lo
+        stack[-1][4] += hi
+
+
+def func_cycles(code, content, returns=True):
+    # content_cycles of a function body with its final RET added, main does
+    # not return and has none
+    (lo, hi), loops = content_cycles(code, content)
+    if returns:
+        lo, hi = lo + RET_CYCLES, hi + RET_CYCLES
+    return (lo, hi), loops
+
+
+def rank(code, funcs, main_func="main"):
+    # ([(hi, lo, name)] of functions, [(hi, lo, name, pc)] of loops), most expensive first
+    func_costs = []
+    loop_costs = []
+    for name, content in funcs.items():
+        if type(content) is dict:
+            continue
+        (lo, hi), loops = func_cycles(code, content, name != main_func)
+        func_costs.append((hi, lo, name))
+        loop_costs += [(l_hi, l_lo, name, pc) for pc, (l_lo, l_hi) in loops.items()]
+    func_costs.sort(key=lambda c: (-c[0], -c[1], c[2]))
+    loop_costs.sort(key=lambda c: (-c[0], -c[1], c[2], c[3]))
+    return func_costs, loop_costs
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="rank the most expensive functions and loops of a gb file")
+    parser.add_argument("gb_file")
+    parser.add_argument("-n", "--top", type=int, default=10, help="entries of each ranking")
+    parser.add_argument("--budget", type=int, default=VBLANK_CYCLES,
+                        help="cycles of one pass, every loop once and callees left out, "
+                             "over which a function is flagged (default: VBlank)")
+    parser.add_argument("--blocks", metavar="FUNC", help="also list the basic blocks of a function")
+    args = parser.parse_args(argv)
+
+    with open(args.gb_file, "rb") as f:
+        code = f.read()
+    tokens = lexer.index_code(code)
+    funcs = explorer.explore(tokens)
+    func_costs, loop_costs = rank(code, funcs)
+
+    print("functions, one pass with every loop once and callees left out:")
+    for hi, lo, name in func_costs[:args.top]:
+        flag = "  one pass over budget" if hi > args.budget else ""
+        print(f"  {name:<24} {format_cycles((lo, hi))}{flag}")
+    print("loops, one iteration:")
+    for hi, lo, name, pc in loop_costs[:args.top]:
+        print(f"  {name:<24} ${pc:04X}  {format_cycles((lo, hi))}")
+
+    if args.blocks:
+        content = funcs.get(args.blocks)
+        if content is None or type(content) is dict:
+            print(f"{args.blocks}: no such decompiled function")
+            return 1
+        slice = absint.flatten(content)
+        print(f"{args.blocks} basic blocks:")
+        for b in annotate_blocks(code, slice):
+            print(f"  ${slice[b.lo][1]:04X}-${slice[b.hi - 1][1]:04X}  {format_cycles(b.cycles)}")
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
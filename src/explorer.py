@@ -1,6 +1,13 @@
 import syntax
 import lexer
 import sys
+import hashlib
+from collections import deque
+from bisect import bisect_left, bisect_right
+from budget import BudgetExceeded, charge
+
+# how far a function end is searched for when no budget stops it earlier
+MAX_SCAN = 10 ** 7
 
 def make_slice(tokens, start, length):
     slice = []
@@ -10,16 +17,15 @@ def make_slice(tokens, start, length):
             slice.append((tok, i))
     return slice
 
-def search_inf_loop(tokens, main_start):
-    pc = main_start
-    while True:
-        assert pc - main_start < 10 ** 7
+def search_inf_loop(tokens, main_start, budget=None):
+    for pc in range(main_start, main_start + MAX_SCAN):
+        charge(budget)
         token = tokens.get(pc, None)
         if token and \
            ((type(token) == syntax.InstAbsJump and token.addr < pc) or \
             (type(token) == syntax.InstRelJump and token.addr < 0)):
             return pc+2
-        pc += 1
+    raise BudgetExceeded(f"no backward jump within {MAX_SCAN} bytes of ${main_start:04X}")
 
 def extract_func_calling(tokens, start, length):
     res = []
@@ -31,72 +37,188 @@ def extract_func_calling(tokens, start, length):
 
     return list(set(res))
 
-def identify_func_len(tokens, pc_start):
-    pc = pc_start
-    while True:
-        assert pc - pc_start < 10 ** 7
+def identify_func_len(tokens, pc_start, budget=None):
+    for pc in range(pc_start, pc_start + MAX_SCAN):
+        charge(budget)
         tok = tokens.get(pc, None)
         if tok and type(tok) == syntax.InstRet:
             return pc - pc_start
-        pc += 1
+    raise BudgetExceeded(f"no RET within {MAX_SCAN} bytes of ${pc_start:04X}")
 
-def deep_explore(slice):
-    if len(slice) < 2:
-        return slice
-    res = []
+# instructions whose addr operand is an absolute CPU address
+ABS_ADDR_INSTS = {
+    syntax.InstCall, syntax.InstConitionalCall,
+    syntax.InstAbsJump, syntax.InstAbsJumpConditional,
+    syntax.InstLoadAddr, syntax.InstStoreAddr,
+}
+
+def cpu_addr(pc):
+    # ROM offset to the address it is seen at: banks above 1 are mapped at $4000
+    return pc if pc < 0x8000 else 0x4000 + pc % 0x4000
+
+def hash_func(tokens, start, length):
+    # hashes the normalized body: positions relative to the start, and absolute
+    # addresses pointing into the body itself relative to its start too, so
+    # identical copies at different addresses hash the same.
+    lo = cpu_addr(start)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(length).encode())
+    for inst, pc in make_slice(tokens, start, length):
+        addr = inst.addr
+        if type(inst) in ABS_ADDR_INSTS and lo <= addr < lo + length:
+            addr = ("rel", addr - lo)
+        h.update(repr((pc - start, type(inst).__name__, inst.op, inst.regl, inst.regr,
+                       inst.imm, inst.cond, addr)).encode())
+    return h.hexdigest()
+
+def is_forward_jr(inst):
+    return type(inst) is not dict and inst.op == "JR" and inst.addr >= 0
+
+def is_backward_jr(inst):
+    return type(inst) is not dict and inst.op == "JR" and inst.addr < 0
+
+def structure_ifs(slice, pcs, log=None):
+    # forward JRs become IF blocks over the instructions they skip.
+    # open blocks are kept on an explicit stack as [lo, hi, block, items]
+    # index ranges into slice, so nesting depth costs no recursion and no copies.
+    root = [0, len(slice), None, []]
+    stack = [root]
     i = 0
     while i < len(slice):
+        while stack[-1][1] <= i:
+            close_if(stack)
+        lo, hi, _, items = stack[-1]
         inst, pc = slice[i]
-        if type(inst) is not dict and inst.op == "JR" and inst.addr >= 0:
-            j = 1
-            while slice[i+j][1] - pc < inst.addr + 2:
-                j += 1
-            print(slice[i+j][1], i, j)
-            assert slice[i+j][1] - pc == inst.addr + 2
-            res.append(({
-                "type": "IF",
-                "inst": slice[i][0],
-                "pc" : pc,
-                "content" : deep_explore(slice[i+1:i+j])
-            }, pc))
-            i += j
+        if hi - lo >= 2 and is_forward_jr(inst):
+            target = pc + inst.addr + 2
+            # the block ends at the jump target, or with its enclosing block
+            j = bisect_left(pcs, target, i + 1, hi)
+            if j < hi:
+                if log:
+                    log(pcs[j], i - lo, j - i)
+                assert pcs[j] == target
+            stack.append([i + 1, j, (inst, pc), []])
         else:
-            res.append(slice[i])
-            i += 1
+            items.append(slice[i])
+        i += 1
+    while len(stack) > 1:
+        close_if(stack)
+    return root[3]
 
-    res2 = []
+def close_if(stack):
+    _, _, (inst, pc), items = stack.pop()
+    stack[-1][3].append(({
+        "type": "IF",
+        "inst": inst,
+        "pc" : pc,
+        "content" : structure_loops(items)
+    }, pc))
+
+def structure_loops(res):
+    # backward JRs become LOOP blocks over the items from their target up to the JR.
+    # walks res from its end with the same explicit stack as structure_ifs,
+    # holding items in reverse order.
+    if len(res) < 2:
+        return res
+    pcs = [pc for _, pc in res]
+    root = [0, len(res), None, []]
+    stack = [root]
     i = len(res) - 1
     while i >= 0:
+        while stack[-1][0] > i:
+            close_loop(stack, res)
+        lo, hi, _, items = stack[-1]
         inst, pc = res[i]
-        if type(inst) is not dict and inst.op == "JR" and inst.addr < 0:
-            off = -inst.addr
-
-            j = 1
-            while pc - res[i-j][1] < off - 2:
-                j += 1
-
-            res2.append(({
-                "type": "LOOP",
-                "inst": res[i][0],
-                "pc": res[i-j][1],
-                "content": deep_explore(res[i-j:i])
-            }, res[i-j][1]))
-            i -= (j + 1)
+        if hi - lo >= 2 and is_backward_jr(inst):
+            target = pc + inst.addr + 2
+            # the loop head is the last item at or before the target
+            k = max(bisect_right(pcs, target, lo, i) - 1, lo)
+            stack.append([k, i, (inst, pc), []])
         else:
-            res2.append(res[i])
-            i -= 1
+            items.append(res[i])
+        i -= 1
+    while len(stack) > 1:
+        close_loop(stack, res)
+    return root[3][::-1]
+
+def close_loop(stack, res):
+    lo, _, (inst, end), items = stack.pop()
+    stack[-1][3].append(({
+        "type": "LOOP",
+        "inst": inst,
+        "pc": res[lo][1],
+        "end": end,
+        "content": items[::-1]
+    }, res[lo][1]))
 
+def deep_explore(slice, log=None, budget=None):
+    # log, when given, is called with debugging data instead of printing it
+    if len(slice) < 2:
+        return slice
+    # structuring is linear in the slice
+    charge(budget, len(slice))
+    pcs = [pc for _, pc in slice]
+    return structure_loops(structure_ifs(slice, pcs, log))
 
-    return res2[::-1]
+def incomplete(pc, reason):
+    return {"type": "INCOMPLETE", "pc": pc, "reason": str(reason)}
 
-def map_all_funcs(tokens, calls):
-    funcs = {}
+def iter_all_funcs(tokens, calls, seen=None, bodies=None, known=None, log=None, budget=None):
+    # yields (name, explored) for every function reachable from calls,
+    # callees first, as soon as each one has been explored.
+    # with bodies (a dict of body hash -> name), copies of a function already
+    # seen are yielded as {"type": "ALIAS", "of": name} and not explored again.
+    # known maps addresses of recognized library routines to their names,
+    # those are yielded as {"type": "SIGNATURE"} without exploring them.
+    # a function that runs out of its budget is yielded as {"type": "INCOMPLETE"},
+    # once the ROM budget runs out nothing more is explored.
+    if seen is None:
+        seen = set()
     for call in calls:
-        flen = identify_func_len(tokens, call)
-        more_calls = extract_func_calling(tokens, call, flen)
-        funcs.update(map_all_funcs(tokens, more_calls))
-        funcs[f"fun_{call:04X}"] = deep_explore(make_slice(tokens, call, flen))
-    return funcs
+        if call in seen:
+            continue
+        if budget is not None and budget.exhausted:
+            return
+        seen.add(call)
+        if known and call in known:
+            yield known[call], {"type": "SIGNATURE", "pc": call}
+            continue
+        name = f"fun_{call:04X}"
+        func_budget = budget.func() if budget is not None else None
+        try:
+            flen = identify_func_len(tokens, call, func_budget)
+            if bodies is not None:
+                body = hash_func(tokens, call, flen)
+                if body in bodies:
+                    forget(tokens)
+                    yield name, {"type": "ALIAS", "of": bodies[body], "pc": call}
+                    continue
+                bodies[body] = name
+            more_calls = extract_func_calling(tokens, call, flen)
+        except BudgetExceeded as e:
+            forget(tokens)
+            yield name, incomplete(call, e)
+            continue
+        # the body is decoded again once the callees are done
+        forget(tokens)
+        if func_budget is not None:
+            func_budget.pause()
+        yield from iter_all_funcs(tokens, more_calls, seen, bodies, known, log, budget)
+        try:
+            content = deep_explore(make_slice(tokens, call, flen), log, func_budget)
+        except BudgetExceeded as e:
+            content = incomplete(call, e)
+        forget(tokens)
+        yield name, content
+
+def forget(tokens):
+    # an on-demand token store drops the instructions of the function just
+    # explored, so that only one function's are decoded at a time
+    if hasattr(tokens, "forget"):
+        tokens.forget()
+
+def map_all_funcs(tokens, calls, dedup=True, known=None):
+    return dict(iter_all_funcs(tokens, calls, bodies={} if dedup else None, known=known))
 
 def handle_entry_point(tokens, pc_start):
     start = tokens[pc_start]
@@ -112,19 +234,50 @@ def handle_entry_point(tokens, pc_start):
         return start.addr + pc_start
 
 
-def explore(tokens, pc_start=0x100, main_func="main"):
-    funcmap = {}
+def call_graph(tokens, pc_start=0x100):
+    # {start: (length, callees)} of main and every function reachable from it,
+    # main first, without exploring any of them. lengths exclude the final RET.
+    # functions whose end is not found are left out.
+    main_start = handle_entry_point(tokens, pc_start)
+    main_len = search_inf_loop(tokens, main_start) - main_start
+    graph = {main_start: (main_len, extract_func_calling(tokens, main_start, main_len))}
+    queue = deque(graph[main_start][1])
+    while queue:
+        call = queue.popleft()
+        if call in graph:
+            continue
+        try:
+            flen = identify_func_len(tokens, call)
+        except BudgetExceeded:
+            continue
+        graph[call] = (flen, extract_func_calling(tokens, call, flen))
+        queue.extend(graph[call][1])
+    return graph
 
+def iter_explore(tokens, pc_start=0x100, main_func="main", dedup=True, known=None, log=None, budget=None):
+    # budget (a budget.Budget) limits the whole ROM and, through func(), each function
     main_start = handle_entry_point(tokens, pc_start)
+    main_budget = budget.func() if budget is not None else None
 
-    jr_pos = search_inf_loop(tokens, main_start)
+    try:
+        jr_pos = search_inf_loop(tokens, main_start, main_budget)
+    except BudgetExceeded as e:
+        # without its end the functions main calls are not known either
+        yield main_func, incomplete(main_start, e)
+        return
 
     calls = extract_func_calling(tokens, main_start, jr_pos - main_start)
 
-    funcmap[main_func] = deep_explore(make_slice(tokens, main_start, jr_pos - main_start))
-    funcmap.update(map_all_funcs(tokens, calls))
+    try:
+        content = deep_explore(make_slice(tokens, main_start, jr_pos - main_start), log, main_budget)
+    except BudgetExceeded as e:
+        content = incomplete(main_start, e)
+    forget(tokens)
+    yield main_func, content
+    yield from iter_all_funcs(tokens, calls, bodies={} if dedup else None, known=known, log=log, budget=budget)
 
-    return funcmap
+def explore(tokens, pc_start=0x100, main_func="main", dedup=True, known=None, log=None, budget=None):
+    return dict(iter_explore(tokens, pc_start, main_func, dedup, known, log, budget))
 
 
 def main(gb_file):
@@ -133,8 +286,16 @@ def main(gb_file):
     print("tokenizing code. this can take a few seconds...")
     tokens = lexer.tokenize_code(readed)
     print("exploring function:")
-    funcmap = explore(tokens)
-    print("\n".join([f"{fun}: {"\n".join([f"\t{c[0]}" for c in cont])}" for fun, cont in funcmap.items()]))
+    funcmap = explore(tokens, log=print)
+    for fun, cont in funcmap.items():
+        if type(cont) is dict and cont["type"] == "INCOMPLETE":
+            print(f"{fun}: incomplete at ${cont['pc']:04X}, {cont['reason']}")
+        elif type(cont) is dict and cont["type"] == "SIGNATURE":
+            print(f"{fun}: library routine at ${cont['pc']:04X}")
+        elif type(cont) is dict:
+            print(f"{fun}: alias of {cont['of']}")
+        else:
+            print(f"{fun}: {"\n".join([f"\t{c[0]}" for c in cont])}")
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
@@ -1,5 +1,8 @@
 import textwrap as tw
 import syntax
+import absint
+import cycles
+from budget import BudgetExceeded, charge
 from expr import Expr
 
 
@@ -19,21 +22,59 @@ class ASTNodeInitial(ASTNode):
     def __str__(self):
         return self.content()
 
+def cycles_comment(node):
+    return f" // {cycles.format_cycles(node.cycles)}" if node.cycles else ""
+
 class ASTNodeFunc(ASTNode):
-    def __init__(self, name, scope):
+    def __init__(self, name, scope, cycles=None):
         super().__init__(scope)
         self.name = name
+        # (lo, hi) clock cycles of one pass, every loop counted once and calls not followed
+        self.cycles = cycles
 
     def __str__(self):
-        return f"{self.name} {{\n{tw.indent(self.content(), INDENT)}\n}}"
+        return f"{self.name} {{{cycles_comment(self)}\n{tw.indent(self.content(), INDENT)}\n}}"
 
 class ASTNodeLoopStmt(ASTNode):
-    def __init__(self, cond: ASTNode, scope):
+    def __init__(self, cond: ASTNode, scope, cycles=None):
         super().__init__(scope)
         self.cond = cond
+        # (lo, hi) clock cycles of one iteration
+        self.cycles = cycles
+
+    def __str__(self):
+        return f"while({self.cond}) {{{cycles_comment(self)}\n{tw.indent(self.content(), INDENT)}\n}}"
+
+class ASTNodeAlias(ASTNode):
+    # a function whose body is identical to an already decompiled one
+    def __init__(self, name, of):
+        super().__init__(scope=[])
+        self.name = name
+        self.of = of
 
     def __str__(self):
-        return f"while({self.cond}) {{\n{tw.indent(self.content(), INDENT)}\n}}"
+        return f"{self.name} = {self.of};"
+
+class ASTNodeLibraryFunc(ASTNode):
+    # a function recognized by its byte signature, not decompiled
+    def __init__(self, name, pc):
+        super().__init__(scope=[])
+        self.name = name
+        self.pc = pc
+
+    def __str__(self):
+        return f"{self.name} {{ /* library routine at ${self.pc:04X} */ }}"
+
+class ASTNodeIncomplete(ASTNode):
+    # a function whose analysis ran out of its budget
+    def __init__(self, name, pc, reason):
+        super().__init__(scope=[])
+        self.name = name
+        self.pc = pc
+        self.reason = reason
+
+    def __str__(self):
+        return f"{self.name} {{ /* incomplete at ${self.pc:04X}: {self.reason} */ }}"
 
 class ASTNodeIfStmt(ASTNode):
     def __init__(self, cond: ASTNode, scope):
@@ -81,29 +122,81 @@ class ASTNodeJumpHandler(ASTNode):
                 raise Exeption("unknown condition")
             return str(self.inst)
 
-def make_scope_for_func(content, regmap):
-    scope = []
-    for inst, _ in content:
-        if type(inst) is not dict:
-            expr = inst.dry_run(regmap)
-            if expr:
-                node = ASTNodeExpression(expr)
-                scope.append(node)
-        else:
-            assert "type" in inst
-            assert inst["type"].upper() in ("IF", "LOOP")
-            inner_scope = make_scope_for_func(inst["content"], regmap)
-            cond = ASTNodeJumpHandler(inst["inst"])
-            if inst["type"].upper() == "IF":
-                scope.append(ASTNodeIfStmt(cond, inner_scope))
+def make_scope_for_func(content, regmap, facts=None, loop_cycles=None, budget=None):
+    # walks the nested IF/LOOP blocks with an explicit stack of
+    # (items, next index, scope, block) frames instead of recursing.
+    # facts (an absint.FunctionAnalysis) fixes up the registers a block
+    # writes once it is left: the dry run went through a loop once and
+    # took the path through an IF, other paths may leave other values.
+    # loop_cycles maps the end pc of loops to their cost per iteration.
+    root = []
+    stack = [(content, 0, root, None)]
+    while stack:
+        items, i, scope, block = stack.pop()
+        while i < len(items):
+            inst, _ = items[i]
+            i += 1
+            charge(budget)
+            if type(inst) is not dict:
+                expr = inst.dry_run(regmap)
+                if expr:
+                    node = ASTNodeExpression(expr)
+                    scope.append(node)
+            else:
+                assert "type" in inst
+                assert inst["type"].upper() in ("IF", "LOOP")
+                stack.append((items, i, scope, block))
+                items, i, scope, block = inst["content"], 0, [], inst
+        if block is not None:
+            parent_scope = stack[-1][2]
+            cond = ASTNodeJumpHandler(block["inst"])
+            if block["type"].upper() == "IF":
+                parent_scope.append(ASTNodeIfStmt(cond, scope))
+                # both paths meet at the jump target
+                exit_pc = absint.jump_target(block["inst"], block["pc"])
+                state = facts.state_before(exit_pc) if facts is not None else None
             else:
-                scope.append(ASTNodeLoopStmt(cond, inner_scope))
-    return scope
+                loop_cost = loop_cycles.get(block.get("end")) if loop_cycles else None
+                parent_scope.append(ASTNodeLoopStmt(cond, scope, loop_cost))
+                exit_pc = block.get("end")
+                state = facts.state_after(exit_pc) if facts is not None and exit_pc is not None else None
+            if facts is not None and exit_pc is not None:
+                for reg in absint.content_writes(block["content"]):
+                    regmap[reg] = absint.describe(state, reg) or reg
+    return root
+
+def iter_ast(explored_funcs, main_func="main", code=None, budget=None):
+    # explored_funcs is a dict or an iterable of (name, explored) pairs.
+    # yields each ASTNodeFunc as soon as it is built.
+    # with the ROM image in code, functions and loops carry cycle estimates.
+    # a function over its budget (a budget.Budget) comes out as ASTNodeIncomplete.
+    # every function is dry run on a regmap of its own: main starts from the
+    # boot values, any other function from unknown registers.
+    if hasattr(explored_funcs, "items"):
+        explored_funcs = explored_funcs.items()
+    for func, content in explored_funcs:
+        if type(content) is dict and content["type"].upper() == "ALIAS":
+            yield ASTNodeAlias(name=func, of=content["of"])
+            continue
+        if type(content) is dict and content["type"].upper() == "SIGNATURE":
+            yield ASTNodeLibraryFunc(name=func, pc=content["pc"])
+            continue
+        if type(content) is dict and content["type"].upper() == "INCOMPLETE":
+            yield ASTNodeIncomplete(name=func, pc=content["pc"], reason=content["reason"])
+            continue
+        regmap = syntax.create_initial_regmap() if func == main_func else syntax.create_func_regmap()
+        func_budget = budget.func() if budget is not None else None
+        try:
+            facts = absint.FunctionAnalysis(absint.flatten(content), absint.entry_state(regmap)).run()
+            charge(func_budget, facts.steps)
+            func_cost, loop_cycles = (None, None) if code is None \
+                else cycles.func_cycles(code, content, func != main_func)
+            func_scope = make_scope_for_func(content, regmap, facts, loop_cycles, func_budget)
+        except BudgetExceeded as e:
+            pc = content[0][1] if content else 0
+            yield ASTNodeIncomplete(name=func, pc=pc, reason=str(e))
+            continue
+        yield ASTNodeFunc(name=func, scope=func_scope, cycles=func_cost)
 
 def build_ast(explored_tokens):
-    scope = []
-    regmap = syntax.create_initial_regmap()
-    for func, content in explored_tokens.items():
-        func_scope = make_scope_for_func(content, regmap)
-        scope.append(ASTNodeFunc(name=func, scope=func_scope))
-    return ASTNodeInitial(scope=scope)
+    return ASTNodeInitial(scope=list(iter_ast(explored_tokens)))
@@ -1,7 +1,9 @@
 from syntax import *
 import sys
-
-instructions = []
+from bisect import bisect_left
+from array import array
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
 
 DIRECT_OP = "[HL]"
 
@@ -307,27 +309,186 @@ def consume(code, endianness="little"):
     raise UnknownInstructionException(f"Unknown instruction: {opcode:02X}")
 
 
-def tokenize_code(code, start_pc=0):
-    tokcode = {}
+BANK_SIZE = 0x4000
+
+def _inst_length(opcode):
+    # the length only depends on the opcode, 0 for one the lexer does not know
+    try:
+        _, rest = consume(bytes([opcode, 0, 0]))
+    except UnknownInstructionException:
+        return 0
+    return 3 - len(rest)
+
+INST_LENGTHS = bytes(_inst_length(opcode) for opcode in range(256))
+
+def iter_tokens(code, start_pc=0, end_pc=None):
+    # yields (pc, inst) pairs as they are decoded, until the code ends or
+    # an instruction starts at or after end_pc. returns the pc it stopped at.
+    # a memoryview keeps every consume() step from copying the rest of the ROM.
+    code = memoryview(code)
     pc = start_pc
-    while len(code) > 0:
+    while len(code) > 0 and (end_pc is None or pc < end_pc):
         try:
             prevlen = len(code)
             inst, code = consume(code)
-            tokcode[pc] = inst
+            yield pc, inst
             pc += prevlen - len(code)
         except UnknownInstructionException:
             code = code[1:]
             pc += 1
+    return pc
 
-    return tokcode
+def tokenize_code(code, start_pc=0):
+    return dict(iter_tokens(code, start_pc))
+
+def inst_starts(code, start=0, end=None):
+    # array of the pcs iter_tokens would yield, found by instruction length
+    # alone without building any instruction. an instruction cut off by the
+    # end of code is left out.
+    starts = array("I")
+    end = len(code) if end is None else end
+    pc = start
+    while pc < end:
+        length = INST_LENGTHS[code[pc]]
+        if length == 0:
+            pc += 1
+            continue
+        if pc + length > len(code):
+            break
+        starts.append(pc)
+        pc += length
+    return starts
+
+def index_code(code):
+    # tokens of the whole image decoded on demand, see LazyTokens
+    return LazyTokens(code, inst_starts(code))
+
+def tokenize_range(code, start, end):
+    # decodes code[start:] until end, the last instruction may run past end.
+    # returns ([(pc, inst)], pc after the last instruction)
+    tokens = []
+    gen = iter_tokens(memoryview(code)[start:], start, end)
+    while True:
+        try:
+            tokens.append(next(gen))
+        except StopIteration as stop:
+            return tokens, stop.value
+
+def _tokenize_bank(shm_name, size, start, end):
+    # only the instruction starts go back to the parent, unpickling the
+    # instructions would cost about as much as decoding them again
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        view = shm.buf[:size]
+        tokens, next_pc = tokenize_range(view, start, end)
+        view.release()
+        return array("I", [pc for pc, _ in tokens]), next_pc
+    finally:
+        shm.close()
+
+class LazyTokens:
+    # a drop-in replacement for the tokens dict of tokenize_code built from
+    # the sorted start pcs of all instructions, each one is decoded the first
+    # time it is looked up. forget() drops what was decoded so far, e.g.
+    # once the function it belongs to is explored.
+    def __init__(self, code, pcs):
+        self.code = memoryview(code)
+        self.pcs = pcs
+        self.decoded = {}
+
+    def get(self, pc, default=None):
+        inst = self.decoded.get(pc)
+        if inst is None:
+            i = bisect_left(self.pcs, pc)
+            if i == len(self.pcs) or self.pcs[i] != pc:
+                return default
+            inst, _ = consume(self.code[pc:])
+            self.decoded[pc] = inst
+        return inst
+
+    def forget(self):
+        self.decoded = {}
+
+    def __getitem__(self, pc):
+        inst = self.get(pc)
+        if inst is None:
+            raise KeyError(pc)
+        return inst
+
+    def __contains__(self, pc):
+        return self.get(pc) is not None
+
+    def __len__(self):
+        return len(self.pcs)
+
+    def items(self):
+        # a pass over everything keeps nothing it decodes
+        for pc in self.pcs:
+            inst = self.decoded.get(pc)
+            if inst is None:
+                inst, _ = consume(self.code[pc:])
+            yield pc, inst
+
+    def keys(self):
+        return list(self.pcs)
+
+    def values(self):
+        for _, inst in self.items():
+            yield inst
+
+    def __iter__(self):
+        return iter(self.pcs)
+
+def tokenize_code_parallel(code, workers=None):
+    # finds the instruction starts of every bank in a process pool, the
+    # workers read the ROM from shared memory. returns LazyTokens with the
+    # same content as the dict of tokenize_code.
+    if len(code) <= BANK_SIZE or workers == 1:
+        return tokenize_code(code)
+
+    shm = shared_memory.SharedMemory(create=True, size=len(code))
+    try:
+        shm.buf[:len(code)] = code
+        starts = range(0, len(code), BANK_SIZE)
+        with ProcessPoolExecutor(workers) as pool:
+            banks = list(pool.map(_tokenize_bank, [shm.name] * len(starts), [len(code)] * len(starts),
+                                  starts, [min(s + BANK_SIZE, len(code)) for s in starts]))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    all_pcs = array("I")
+    carry = 0
+    for start, (pcs, next_pc) in zip(starts, banks):
+        end = min(start + BANK_SIZE, len(code))
+        i = 0
+        if carry > start:
+            # the previous bank's last instruction ran into this bank, so this
+            # bank's decoding may be misaligned until both agree on a pc
+            i = bisect_left(pcs, carry)
+            if i == len(pcs) or pcs[i] != carry:
+                gen = iter_tokens(memoryview(code)[carry:], carry, end)
+                while True:
+                    try:
+                        pc, _ = next(gen)
+                    except StopIteration as stop:
+                        i, next_pc = len(pcs), stop.value
+                        break
+                    i = bisect_left(pcs, pc)
+                    if i < len(pcs) and pcs[i] == pc:
+                        break
+                    all_pcs.append(pc)
+        all_pcs.extend(pcs[i:])
+        carry = next_pc
+
+    return LazyTokens(code, all_pcs)
 
 def main(gb_file):
     with open(gb_file, "rb") as f:
         code = f.read(0x100)
 
     toks = tokenize_code(code)
-    print("\n".join([str(t) for t in toks]))
+    print("\n".join([f"${pc:04X}  {t}" for pc, t in toks.items()]))
 
     return 0
 
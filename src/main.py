@@ -1,7 +1,13 @@
 import sys
-from lexer import tokenize_code
-from explorer import explore
-from gb_ast import build_ast
+import argparse
+from lexer import index_code, tokenize_code_parallel
+from bankcache import BankedTokens
+from regions import RegionTokens
+from explorer import iter_explore
+from gb_ast import iter_ast
+from signatures import SignatureLibrary
+from budget import Budget
+from lr35902dis import lr35902 as disassembler
 
 def print_debugging_data(code):
     print(" ".join([f"{c:02X}" for c in code]))
@@ -15,22 +21,59 @@ def print_debugging_data(code):
     if inst:
         print(f"also: {inst}")
 
-def main(gb_file):
+def main(gb_file, signatures=None, jobs=1, max_decoded_mb=None, show_cycles=False, limits=None,
+         skip_data=False):
     with open(gb_file, "rb") as f:
         raw_code = f.read()
 
-    print("tokenizing...")
-    tokens = tokenize_code(raw_code)
-    print("exploring...")
-    explored = explore(tokens)
-    print("building AST...")
-    ast = build_ast(explored)
+    known = None
+    if signatures:
+        print("matching signatures...")
+        known = SignatureLibrary.load(signatures).scan(raw_code)
 
-    print(ast)
+    print("tokenizing...")
+    if skip_data:
+        tokens = RegionTokens(raw_code)
+    elif max_decoded_mb is not None:
+        tokens = BankedTokens(raw_code, int(max_decoded_mb * 2 ** 20))
+    elif jobs == 1:
+        tokens = index_code(raw_code)
+    else:
+        tokens = tokenize_code_parallel(raw_code, jobs)
+    print("exploring and building AST...")
+    # each function is printed as soon as it is explored and built,
+    # a function over its budget is printed as incomplete
+    budget = Budget(**(limits or {}))
+    for func in iter_ast(iter_explore(tokens, known=known, budget=budget),
+                         code=raw_code if show_cycles else None, budget=budget):
+        print(func, flush=True)
 
     return 0
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("provide .gb file")
-    sys.exit(main(sys.argv[1]))
+    parser = argparse.ArgumentParser(description="decompile a gb file")
+    parser.add_argument("gb_file")
+    parser.add_argument("--signatures", help="signature library of known routines to skip")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="processes tokenizing banks in parallel (0 for one per core)")
+    parser.add_argument("--max-decoded-mb", type=float,
+                        help="memory ceiling for decoded banks, least recently used ones are decoded again on demand")
+    parser.add_argument("--skip-data", action="store_true",
+                        help="only decode regions classified as data when something points into them")
+    parser.add_argument("--cycles", action="store_true", help="annotate functions and loops with cycle estimates")
+    parser.add_argument("--max-steps", type=int, help="steps for the whole ROM")
+    parser.add_argument("--max-seconds", type=float, help="wall time for the whole ROM")
+    parser.add_argument("--func-max-steps", type=int, help="steps for each function")
+    parser.add_argument("--func-max-seconds", type=float, help="wall time for each function")
+    args = parser.parse_args()
+    # each of these picks its own way of decoding the ROM
+    if args.skip_data and args.max_decoded_mb is not None:
+        parser.error("--skip-data and --max-decoded-mb can not be combined")
+    if args.skip_data and args.jobs != 1:
+        parser.error("--skip-data and --jobs can not be combined")
+    if args.max_decoded_mb is not None and args.jobs != 1:
+        parser.error("--max-decoded-mb and --jobs can not be combined")
+    sys.exit(main(args.gb_file, signatures=args.signatures, jobs=args.jobs or None,
+                  max_decoded_mb=args.max_decoded_mb, show_cycles=args.cycles, skip_data=args.skip_data,
+                  limits={"steps": args.max_steps, "seconds": args.max_seconds,
+                          "func_steps": args.func_max_steps, "func_seconds": args.func_max_seconds}))
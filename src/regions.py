@@ -0,0 +1,188 @@
+import sys
+import argparse
+import numpy as np
+from lexer import tokenize_range
+
+# code/data classification of fixed size windows of a ROM image, so that
+# tile graphics, maps, audio and padding are not decoded as instructions.
+# every feature is computed for all windows at once:
+#   entropy     bits per byte, compressed data and audio come close to 8
+#   invalid     share of bytes that are no opcode on the CPU, code has next to none
+#   padding     share of bytes in runs of one value, e.g. $FF fill
+#   tile        share of bytes repeating 1, 2 or 16 bytes later, as rows and
+#               bitplanes of 2bpp tiles do, padding runs left out
+
+WINDOW = 256
+PAD_RUN = 8
+INVALID_OPCODES = [0xD3, 0xDB, 0xDD, 0xE3, 0xE4, 0xEB, 0xEC, 0xED, 0xF4, 0xFC, 0xFD]
+
+MAX_CODE_PADDING = 0.75
+MAX_CODE_INVALID = 0.025
+MIN_DATA_ENTROPY = 6.5
+MAX_CODE_TILE = 0.5
+
+
+def features(code, window=WINDOW):
+    # {name: array with one value per full window}, a partial last window is left out
+    n = len(code) // window
+    data = np.frombuffer(code, dtype=np.uint8, count=n * window)
+    windows = data.reshape(n, window)
+    if n == 0:
+        empty = np.zeros(0)
+        return {"entropy": empty, "invalid": empty, "padding": empty, "tile": empty}
+
+    # byte histogram of every window in one bincount
+    keys = (np.arange(n * window) // window) * 256 + data
+    p = np.bincount(keys, minlength=n * 256).reshape(n, 256) / window
+    entropy = -(p * np.log2(p, out=np.zeros_like(p), where=p > 0)).sum(axis=1)
+
+    invalid = np.zeros(256, dtype=bool)
+    invalid[INVALID_OPCODES] = True
+    invalid = invalid[windows].mean(axis=1)
+
+    # run lengths of equal bytes, spread back over the bytes of every run
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(data)) + 1))
+    lengths = np.diff(np.concatenate((starts, [len(data)])))
+    in_pad = np.repeat(lengths >= PAD_RUN, lengths).reshape(n, window)
+    padding = in_pad.mean(axis=1)
+
+    tile = np.zeros(n)
+    rest = np.maximum((~in_pad).sum(axis=1), 1)
+    for lag in (1, 2, 16):
+        same = np.zeros(n * window, dtype=bool)
+        same[:-lag] = data[lag:] == data[:-lag]
+        same = same.reshape(n, window) & ~in_pad
+        if lag == 1:
+            # the two bitplanes of a row sit at even offsets
+            same[:, 1::2] = False
+            score = same.sum(axis=1) * 2 / rest
+        else:
+            score = same.sum(axis=1) / rest
+        tile = np.maximum(tile, score)
+
+    return {"entropy": entropy, "invalid": invalid, "padding": padding, "tile": tile}
+
+
+def classify(code, window=WINDOW):
+    # bool array, True for every full window that looks like data
+    f = features(code, window)
+    return (f["padding"] > MAX_CODE_PADDING) \
+        | ((f["invalid"] > MAX_CODE_INVALID) & (f["entropy"] > MIN_DATA_ENTROPY)) \
+        | (f["tile"] > MAX_CODE_TILE)
+
+
+def runs(is_data, size, window=WINDOW):
+    # [(start, end, data)] of consecutive windows of one kind, covering size bytes
+    res = []
+    for i, data in enumerate(is_data.tolist()):
+        if res and res[-1][2] == data:
+            res[-1] = (res[-1][0], (i + 1) * window, data)
+        else:
+            res.append((i * window, (i + 1) * window, data))
+    tail = len(is_data) * window
+    if tail < size:
+        if res and not res[-1][2]:
+            res[-1] = (res[-1][0], size, False)
+        else:
+            res.append((tail, size, False))
+    return res
+
+
+class RegionTokens:
+    # a drop-in replacement for the tokens dict of tokenize_code that only
+    # decodes the code windows up front. a data window is decoded the first
+    # time something looks inside it, e.g. a call pointing into it, starting
+    # where decoding of the window before it ended.
+    def __init__(self, code, is_data=None, window=WINDOW):
+        self.code = code
+        self.window = window
+        if is_data is None:
+            is_data = classify(code, window)
+        self.tokens = {}
+        self.decoded = 0
+        # windows still to decode: {window index: pc to start at}
+        self.pending = {}
+        carry = 0
+        for start, end, data in runs(is_data, len(code), window):
+            if data:
+                for w in range(start // window, end // window):
+                    self.pending[w] = w * window
+                if carry > start:
+                    self.pending[start // window] = carry
+            else:
+                carry = self._decode(max(carry, start), end)
+
+    def _decode(self, start, end):
+        # returns the pc after the last instruction
+        tokens, next_pc = tokenize_range(self.code, start, end)
+        self.tokens.update(tokens)
+        self.decoded += max(end - start, 0)
+        return next_pc
+
+    def _reach(self, pc):
+        # decodes the pending window holding pc, if any
+        w = pc // self.window
+        entry = self.pending.pop(w, None)
+        if entry is None:
+            return
+        next_pc = self._decode(entry, (w + 1) * self.window)
+        if w + 1 in self.pending:
+            self.pending[w + 1] = max(self.pending[w + 1], next_pc)
+
+    def get(self, pc, default=None):
+        tok = self.tokens.get(pc)
+        if tok is None and self.pending:
+            self._reach(pc)
+            tok = self.tokens.get(pc)
+        return default if tok is None else tok
+
+    def __getitem__(self, pc):
+        tok = self.get(pc)
+        if tok is None:
+            raise KeyError(pc)
+        return tok
+
+    def __contains__(self, pc):
+        return self.get(pc) is not None
+
+    # the views below only cover what has been decoded so far
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def items(self):
+        return sorted(self.tokens.items())
+
+    def keys(self):
+        return sorted(self.tokens)
+
+    def values(self):
+        return [inst for _, inst in self.items()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="classify the windows of a gb file as code or data")
+    parser.add_argument("gb_file")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the features of every window")
+    args = parser.parse_args(argv)
+
+    with open(args.gb_file, "rb") as f:
+        code = f.read()
+    f = features(code)
+    is_data = classify(code)
+    if args.verbose:
+        for i, data in enumerate(is_data.tolist()):
+            print(f"${i * WINDOW:06X}  {'data' if data else 'code'}  entropy {f['entropy'][i]:.2f}  "
+                  f"invalid {f['invalid'][i]:.3f}  padding {f['padding'][i]:.2f}  tile {f['tile'][i]:.2f}")
+    for start, end, data in runs(is_data, len(code)):
+        print(f"${start:06X}-${end - 1:06X}  {'data' if data else 'code'}")
+    share = is_data.mean() if len(is_data) else 0
+    print(f"{share:.0%} of {len(code)} bytes classified as data")
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
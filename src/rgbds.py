@@ -0,0 +1,284 @@
+import sys
+import argparse
+import syntax
+import lexer
+from lexer import BANK_SIZE
+
+# RGBDS listing of a whole ROM image, written line by line as it is decoded.
+# a first pass collects every jump and call target into one sorted index,
+# the second decodes again and merges the labels in while writing. only the
+# index is kept in memory, never the decoded image.
+# anything that would not assemble back to the same bytes is written as db:
+# unknown opcodes, the cartridge header, instructions a label points into or
+# that run over a bank end, and the opcodes the lexer decodes wrong.
+
+HEADER = range(0x104, 0x150)
+DB_PER_LINE = 16
+
+# the lexer gets the operands or the length of these wrong, see conformance.py
+UNSAFE_OPCODES = {
+    0x02, 0x12, 0x22, 0x32,     # LD [r16], A
+    0x0A, 0x1A, 0x2A, 0x3A,     # LD A, [r16]
+    0x03, 0x13, 0x23, 0x33,     # INC r16
+    0xE2, 0xF2,                 # LD [C], A / LD A, [C]
+}
+
+CB_OPS = ["rlc", "rrc", "rl", "rr", "sla", "sra", "swap", "srl"]
+
+JUMPS = {syntax.InstRelJump, syntax.InstRelJumpConditional,
+         syntax.InstAbsJump, syntax.InstAbsJumpConditional}
+CALLS = {syntax.InstCall, syntax.InstConitionalCall}
+
+
+def iter_decoded(code, start=0, end=None):
+    # yields (pc, inst, length) like lexer.iter_tokens does, with
+    # inst None for a byte the lexer does not know
+    view = memoryview(code)
+    end = len(code) if end is None else end
+    pc = start
+    while pc < end:
+        try:
+            inst, rest = lexer.consume(view[pc:])
+        except (lexer.UnknownInstructionException, IndexError):
+            yield pc, None, 1
+            pc += 1
+            continue
+        length = len(view) - pc - len(rest)
+        yield pc, inst, length
+        pc += length
+
+
+def iter_image(code):
+    # iter_decoded over the image with the header left undecoded. an
+    # instruction running into the header is left undecoded as well.
+    for pc, inst, length in iter_decoded(code, 0, min(HEADER.start, len(code))):
+        if pc + length > HEADER.start:
+            for p in range(pc, HEADER.start):
+                yield p, None, 1
+        else:
+            yield pc, inst, length
+    for pc in HEADER:
+        if pc < len(code):
+            yield pc, None, 1
+    yield from iter_decoded(code, HEADER.stop)
+
+
+def is_safe(inst, data):
+    if inst is None or data[0] in UNSAFE_OPCODES:
+        return False
+    # STOP is assembled with a zero padding byte
+    return data[0] != 0x10 or data[1] == 0
+
+
+def rom_offset(code, pc, addr):
+    # the image offset an address used by the instruction at pc points to,
+    # None outside the ROM or when the switchable bank can not be known
+    if addr < BANK_SIZE:
+        return addr
+    if addr >= 2 * BANK_SIZE:
+        return None
+    if pc >= BANK_SIZE:
+        offset = pc // BANK_SIZE * BANK_SIZE + addr - BANK_SIZE
+    elif len(code) <= 2 * BANK_SIZE:
+        offset = addr
+    else:
+        return None
+    return offset if offset < len(code) else None
+
+
+def target(code, inst, pc):
+    if type(inst) in {syntax.InstRelJump, syntax.InstRelJumpConditional}:
+        return rom_offset(code, pc, (cpu_addr(pc) + 2 + inst.addr) & 0xFFFF)
+    return rom_offset(code, pc, inst.addr)
+
+
+def cpu_addr(offset):
+    return offset if offset < BANK_SIZE else BANK_SIZE + offset % BANK_SIZE
+
+
+def label_name(offset, call):
+    prefix = "fun" if call else "lbl"
+    if offset < BANK_SIZE:
+        return f"{prefix}_{offset:04X}"
+    return f"{prefix}_{offset // BANK_SIZE:02X}_{cpu_addr(offset):04X}"
+
+
+def label_index(code):
+    # one pass: {offset: is called} of every jump and call target
+    targets = {}
+    for pc, inst, length in iter_image(code):
+        if type(inst) not in JUMPS and type(inst) not in CALLS:
+            continue
+        if not is_safe(inst, code[pc:pc+length]):
+            continue
+        offset = target(code, inst, pc)
+        if offset is not None:
+            targets[offset] = targets.get(offset, False) or type(inst) in CALLS
+    return targets
+
+
+def operand(code, inst, pc, labels):
+    # a jump or call target, by label when it has one
+    offset = target(code, inst, pc)
+    if offset is not None and offset in labels:
+        return label_name(offset, labels[offset])
+    if type(inst) in {syntax.InstRelJump, syntax.InstRelJumpConditional}:
+        return f"@{inst.addr + 2:+d}"
+    return f"${inst.addr:04X}"
+
+
+def asm(code, inst, pc, data, labels):
+    # the RGBDS text of a decoded instruction
+    t = type(inst)
+    op = inst.op.split()[0].lower()
+    if t in JUMPS or t in CALLS:
+        dest = operand(code, inst, pc, labels)
+        return f"{op} {inst.cond.lower()}, {dest}" if inst.cond else f"{op} {dest}"
+    if t == syntax.InstConitionalRet:
+        return f"ret {inst.cond.lower()}"
+    if t in {syntax.InstCBPrefix, syntax.InstCBPrefixDirect}:
+        beta = data[1] >> 3
+        reg = "[hl]" if data[1] & 7 == 6 else inst.regl.lower()
+        if beta < 8:
+            return f"{CB_OPS[beta]} {reg}"
+        return f"{['bit', 'res', 'set'][beta // 8 - 1]} {beta % 8}, {reg}"
+    if t == syntax.InstALU and inst.op in lexer.OP_ORDER:
+        return f"{op} a, {inst.regr.lower()}"
+    if t == syntax.InstALU:
+        return op
+    if t == syntax.InstALUDirect:
+        return f"{op} a, [hl]"
+    if t == syntax.InstALUImmediate:
+        return f"{op} a, ${inst.imm:02X}"
+    if t == syntax.InstALUregSP:
+        return f"add sp, {data[1] - 256 if data[1] >= 128 else data[1]}"
+    if t == syntax.InstALU16bit:
+        return f"add hl, {inst.regr.lower()}"
+    if t == syntax.InstReset:
+        return f"rst ${inst.imm:02X}"
+    if t in {syntax.InstPush, syntax.InstPop}:
+        return f"{op} {(inst.regl + inst.regr).lower()}"
+    if t == syntax.InstLoadImmediate16bit:
+        return f"ld {inst.regl.lower()}, ${inst.imm:04X}"
+    if t == syntax.InstLoadImmediateDirect:
+        return f"ld [hl], ${inst.imm:02X}"
+    if t == syntax.InstLoadImmediate:
+        return f"ld {inst.regl.lower()}, ${inst.imm:02X}"
+    if t == syntax.InstHighStore:
+        # the lexer builds "LDH A, (a8)" as a store as well
+        if "load" in inst.op:
+            return f"ldh a, [$FF{inst.addr:02X}]"
+        return f"ldh [$FF{inst.addr:02X}], a"
+    if t == syntax.InstStoreAddr:
+        return f"ld [${inst.addr:04X}], a"
+    if t == syntax.InstLoadAddr:
+        return f"ld a, [${inst.addr:04X}]"
+    if t == syntax.InstIncDecDirect:
+        return f"{op} [hl]"
+    if isinstance(inst, syntax.InstFamilyOpOnly):
+        return op
+    if isinstance(inst, syntax.InstFamilySingleReg):
+        return f"{op} {inst.regl.lower()}"
+    if isinstance(inst, syntax.InstFamilyTwoRegs):
+        return f"{op} {inst.regl.lower()}, {inst.regr.lower()}"
+    if isinstance(inst, syntax.InstFamilyStoreReg):
+        return f"{op} [{inst.regl.lower().strip('[]')}], {inst.regr.lower()}"
+    if isinstance(inst, syntax.InstFamilyLoadReg):
+        return f"{op} {inst.regl.lower()}, [{inst.regr.lower().strip('[]')}]"
+    return None
+
+
+class Writer:
+    # writes the listing, placing sections and labels in front of the bytes they belong to
+    def __init__(self, out, code, labels):
+        self.out = out
+        self.code = code
+        self.labels = labels
+        self.sorted_labels = sorted(labels)
+        self.next_label = 0
+        self.bank = None
+
+    def boundary(self, pc):
+        # the first offset after pc a section or a label starts at
+        stop = (pc // BANK_SIZE + 1) * BANK_SIZE
+        i = self.next_label
+        while i < len(self.sorted_labels) and self.sorted_labels[i] <= pc:
+            i += 1
+        if i < len(self.sorted_labels):
+            stop = min(stop, self.sorted_labels[i])
+        return stop
+
+    def enter(self, pc):
+        # sections and labels that start at pc
+        if pc % BANK_SIZE == 0 and pc // BANK_SIZE != self.bank:
+            self.bank = pc // BANK_SIZE
+            if self.bank == 0:
+                self.out.write('SECTION "ROM Bank $000", ROM0[$0000]\n')
+            else:
+                self.out.write(f'\nSECTION "ROM Bank ${self.bank:03X}", ROMX[$4000], BANK[${self.bank:X}]\n')
+        while self.next_label < len(self.sorted_labels) and self.sorted_labels[self.next_label] <= pc:
+            offset = self.sorted_labels[self.next_label]
+            if offset == pc:
+                self.out.write(f"\n{label_name(offset, self.labels[offset])}:\n")
+            self.next_label += 1
+
+    def text(self, pc, inst, length):
+        # the instruction as text, None when it has to be written as bytes
+        data = self.code[pc:pc+length]
+        if not is_safe(inst, data) or length != len(data) or pc + length > self.boundary(pc):
+            return None
+        return asm(self.code, inst, pc, data, self.labels)
+
+    def inst(self, pc, text):
+        self.enter(pc)
+        self.out.write(f"\t{text}\n")
+
+    def data(self, lo, hi):
+        pc = lo
+        while pc < hi:
+            self.enter(pc)
+            end = min(hi, pc + DB_PER_LINE, self.boundary(pc))
+            self.out.write("\tdb " + ", ".join(f"${b:02X}" for b in self.code[pc:end]) + "\n")
+            pc = end
+
+
+def export(code, out):
+    # returns the number of labels
+    labels = label_index(code)
+    writer = Writer(out, code, labels)
+    run = None
+    for pc, inst, length in iter_image(code):
+        text = writer.text(pc, inst, length)
+        if text is None:
+            # bytes are collected into db runs
+            if run is None:
+                run = pc
+            continue
+        if run is not None:
+            writer.data(run, pc)
+            run = None
+        writer.inst(pc, text)
+    if run is not None:
+        writer.data(run, len(code))
+    return len(labels)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="write an RGBDS listing of a gb file")
+    parser.add_argument("gb_file")
+    parser.add_argument("asm_file", nargs="?", default="-", help="output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    with open(args.gb_file, "rb") as f:
+        code = f.read()
+    if args.asm_file == "-":
+        export(code, sys.stdout)
+    else:
+        with open(args.asm_file, "w") as f:
+            labels = export(code, f)
+        print(f"{args.asm_file}: {len(code)} bytes, {labels} labels")
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
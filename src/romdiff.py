@@ -0,0 +1,166 @@
+import sys
+import difflib
+import argparse
+import syntax
+import lexer
+import explorer
+import gb_ast
+
+# function level diff of two ROM images. functions are matched by the hash of
+# their normalized body first, then by their position in the call graph.
+# only the functions that differ are explored and turned into an AST.
+
+
+class RomFuncs:
+    def __init__(self, code):
+        self.tokens = lexer.index_code(code)
+        self.graph = explorer.call_graph(self.tokens)
+        self.main = next(iter(self.graph))
+        self.hashes = {start: explorer.hash_func(self.tokens, start, length)
+                       for start, (length, _) in self.graph.items()}
+
+    def name(self, start):
+        return "main" if start == self.main else f"fun_{start:04X}"
+
+    def callees(self, start):
+        # called functions in call site order
+        length, _ = self.graph[start]
+        res = []
+        for inst, _ in explorer.make_slice(self.tokens, start, length):
+            if type(inst) in {syntax.InstCall, syntax.InstConitionalCall} and inst.addr not in res:
+                res.append(inst.addr)
+        return res
+
+    def render(self, start):
+        length, _ = self.graph[start]
+        explored = explorer.deep_explore(explorer.make_slice(self.tokens, start, length))
+        func, = gb_ast.iter_ast([(self.name(start), explored)])
+        return str(func)
+
+    def listing(self, start):
+        # the instructions themselves, for changes the AST does not show
+        length, _ = self.graph[start]
+        return [f"${pc:04X}  {inst}" for inst, pc in explorer.make_slice(self.tokens, start, length)]
+
+
+def match(a, b):
+    # returns {start in a: start in b}
+    pairs = {}
+    matched_b = set()
+
+    # identical bodies: at the same address first, then at the nearest one
+    # when a body appears several times
+    by_hash = {}
+    for start, h in b.hashes.items():
+        by_hash.setdefault(h, []).append(start)
+    for start, h in a.hashes.items():
+        if b.hashes.get(start) == h:
+            pairs[start] = start
+            matched_b.add(start)
+    for start, h in a.hashes.items():
+        if start in pairs:
+            continue
+        candidates = [s for s in by_hash.get(h, []) if s not in matched_b]
+        if candidates:
+            other = min(candidates, key=lambda s: abs(s - start))
+            pairs[start] = other
+            matched_b.add(other)
+
+    # what is left is matched by call graph position: the n-th unmatched
+    # callee of a matched pair matches the n-th unmatched callee on the other side
+    if a.main not in pairs and b.main not in matched_b:
+        pairs[a.main] = b.main
+        matched_b.add(b.main)
+    queue = list(pairs.items())
+    while queue:
+        sa, sb = queue.pop()
+        ca = [c for c in a.callees(sa) if c in a.graph and c not in pairs]
+        cb = [c for c in b.callees(sb) if c in b.graph and c not in matched_b]
+        for x, y in zip(ca, cb):
+            pairs[x] = y
+            matched_b.add(y)
+            queue.append((x, y))
+
+    # and finally functions left at the same address
+    for start in a.graph:
+        if start not in pairs and start in b.graph and start not in matched_b:
+            pairs[start] = start
+            matched_b.add(start)
+
+    return pairs
+
+
+def same_body(a, sa, b, sb, pairs):
+    # identical up to absolute addresses of matched functions, e.g. a call
+    # to a function that only moved
+    length, _ = a.graph[sa]
+    if b.graph[sb][0] != length:
+        return False
+    slice_a = explorer.make_slice(a.tokens, sa, length)
+    slice_b = explorer.make_slice(b.tokens, sb, length)
+    if len(slice_a) != len(slice_b):
+        return False
+    for (ia, pa), (ib, pb) in zip(slice_a, slice_b):
+        if pa - sa != pb - sb or type(ia) != type(ib):
+            return False
+        va, vb = dict(vars(ia)), dict(vars(ib))
+        addr_a, addr_b = va.pop("addr"), vb.pop("addr")
+        if va != vb:
+            return False
+        if addr_a != addr_b and not (type(ia) in explorer.ABS_ADDR_INSTS and pairs.get(addr_a) == addr_b) \
+           and not (sa <= addr_a < sa + length and addr_a - sa == addr_b - sb):
+            return False
+    return True
+
+
+def diff(code_a, code_b):
+    # returns {"unchanged": n, "moved": [(a, b)], "changed": [(a, b, diff lines)],
+    #          "added": [b], "removed": [a]} with function names
+    a, b = RomFuncs(code_a), RomFuncs(code_b)
+    pairs = match(a, b)
+    res = {"unchanged": 0, "moved": [], "changed": [], "added": [], "removed": []}
+    for sa, sb in sorted(pairs.items()):
+        if a.hashes[sa] != b.hashes[sb] and not same_body(a, sa, b, sb, pairs):
+            lines_a, lines_b = a.render(sa).splitlines(), b.render(sb).splitlines()
+            if lines_a == lines_b:
+                lines_a, lines_b = a.listing(sa), b.listing(sb)
+            lines = list(difflib.unified_diff(lines_a, lines_b,
+                                              f"a/{a.name(sa)}", f"b/{b.name(sb)}", lineterm=""))
+            res["changed"].append((a.name(sa), b.name(sb), lines))
+        elif sa != sb:
+            res["moved"].append((a.name(sa), b.name(sb)))
+        else:
+            res["unchanged"] += 1
+    matched_b = set(pairs.values())
+    res["removed"] = [a.name(s) for s in sorted(a.graph) if s not in pairs]
+    res["added"] = [b.name(s) for s in sorted(b.graph) if s not in matched_b]
+    return res
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="function level diff of two gb files")
+    parser.add_argument("gb_file_a")
+    parser.add_argument("gb_file_b")
+    args = parser.parse_args(argv)
+
+    with open(args.gb_file_a, "rb") as f:
+        code_a = f.read()
+    with open(args.gb_file_b, "rb") as f:
+        code_b = f.read()
+
+    res = diff(code_a, code_b)
+    print(f"unchanged: {res['unchanged']}")
+    for name_a, name_b in res["moved"]:
+        print(f"moved:     {name_a} -> {name_b}")
+    for name in res["removed"]:
+        print(f"removed:   {name}")
+    for name in res["added"]:
+        print(f"added:     {name}")
+    for name_a, name_b, lines in res["changed"]:
+        print(f"changed:   {name_a}" + (f" -> {name_b}" if name_a != name_b else ""))
+        print("\n".join(lines))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
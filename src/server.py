@@ -0,0 +1,253 @@
+import os
+import sys
+import json
+import socket
+import asyncio
+import inspect
+import argparse
+from collections import OrderedDict
+import session
+import xrefs
+
+# a long running decompiler: newline delimited JSON-RPC 2.0 over a unix socket.
+# analysed ROMs stay in memory, least recently used ones are evicted first.
+
+DEFAULT_SOCKET = "/tmp/gbdecompiler.sock"
+# longest request line, room for patching a whole 8 MiB image in hex
+MAX_REQUEST = 32 << 20
+
+PARSE_ERROR      = -32700
+INVALID_REQUEST  = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS   = -32602
+SERVER_ERROR     = -32000
+
+
+class RPCError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class Analysis(session.Session):
+    # a session over a ROM file that can be patched in memory or read again
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            super().__init__(f.read())
+
+    def reset(self):
+        with self.lock:
+            super().reset()
+            self._xrefs = None
+
+    @property
+    def xrefs(self):
+        with self.lock:
+            if self._xrefs is None:
+                self._xrefs = xrefs.XrefDB.from_tokens(self.tokens)
+            return self._xrefs
+
+    def patch(self, offset, data):
+        if offset < 0 or offset + len(data) > len(self.code):
+            raise RPCError(INVALID_PARAMS, f"patch at ${offset:X} is outside the image")
+        with self.lock:
+            self.code[offset:offset+len(data)] = data
+            self.reset()
+
+    def reload(self):
+        with open(self.path, "rb") as f:
+            code = bytearray(f.read())
+        with self.lock:
+            self.code = code
+            self.reset()
+
+
+class Server:
+    def __init__(self, max_roms=8, max_request=MAX_REQUEST):
+        self.max_roms = max_roms
+        self.max_request = max_request
+        self.roms = OrderedDict()
+        self.locks = {}
+
+    def lock(self, path):
+        return self.locks.setdefault(path, asyncio.Lock())
+
+    def get(self, path):
+        path = os.path.abspath(path)
+        if path in self.roms:
+            self.roms.move_to_end(path)
+            return self.roms[path]
+        if not os.path.isfile(path):
+            raise RPCError(INVALID_PARAMS, f"no such file: {path}")
+        analysis = Analysis(path)
+        self.roms[path] = analysis
+        while len(self.roms) > self.max_roms:
+            evicted, _ = self.roms.popitem(last=False)
+            self.locks.pop(evicted, None)
+        return analysis
+
+    async def run(self, rom, fn):
+        # analysis is CPU bound, keep the event loop free for other clients
+        # while requests on the same ROM wait for each other
+        analysis = self.get(rom)
+        async with self.lock(analysis.path):
+            return await asyncio.get_running_loop().run_in_executor(None, fn, analysis)
+
+    async def rpc_load(self, rom):
+        return await self.run(rom, lambda a: {"rom": a.path, "size": len(a.code), "functions": len(a.funcs)})
+
+    async def rpc_list_functions(self, rom):
+        return await self.run(rom, lambda a: list(a.funcs))
+
+    async def rpc_decompile_function(self, rom, name):
+        def decompile(a):
+            if name not in a.ast:
+                raise RPCError(INVALID_PARAMS, f"unknown function: {name}")
+            return str(a.ast[name])
+        return await self.run(rom, decompile)
+
+    async def rpc_xrefs(self, rom, addr, kind=None):
+        addr = int(addr.lstrip("$"), 16) if type(addr) == str else addr
+        return await self.run(rom, lambda a: [{"src": src, "kind": k, "funcs": a.xrefs.funcs_at(src)}
+                                              for src, k in a.xrefs.refs(addr)
+                                              if kind is None or k == kind])
+
+    async def rpc_patch(self, rom, offset, data):
+        data = bytes.fromhex(data)
+        def patch(a):
+            a.patch(offset, data)
+            return {"functions": len(a.funcs)}
+        return await self.run(rom, patch)
+
+    async def rpc_reanalyse(self, rom):
+        def reanalyse(a):
+            a.reload()
+            return {"functions": len(a.funcs)}
+        return await self.run(rom, reanalyse)
+
+    async def rpc_unload(self, rom):
+        path = os.path.abspath(rom)
+        self.locks.pop(path, None)
+        return self.roms.pop(path, None) is not None
+
+    async def dispatch(self, request):
+        if type(request) is not dict or request.get("jsonrpc") != "2.0" or "method" not in request:
+            raise RPCError(INVALID_REQUEST, "not a JSON-RPC 2.0 request")
+        method = getattr(self, f"rpc_{request['method']}", None)
+        if method is None:
+            raise RPCError(METHOD_NOT_FOUND, f"unknown method: {request['method']}")
+        params = request.get("params", {})
+        if type(params) not in {list, dict}:
+            raise RPCError(INVALID_PARAMS, "params must be an array or an object")
+        try:
+            if type(params) is list:
+                bound = inspect.signature(method).bind(*params)
+            else:
+                bound = inspect.signature(method).bind(**params)
+        except TypeError as e:
+            raise RPCError(INVALID_PARAMS, str(e))
+        return await method(*bound.args, **bound.kwargs)
+
+    async def handle_line(self, line):
+        # returns the response, None for a notification: a request without an id
+        request = None
+        try:
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise RPCError(PARSE_ERROR, str(e))
+            response = {"result": await self.dispatch(request)}
+        except RPCError as e:
+            response = {"error": {"code": e.code, "message": str(e)}}
+        except Exception as e:
+            response = {"error": {"code": SERVER_ERROR, "message": f"{type(e).__name__}: {e}"}}
+        if type(request) is dict and "id" not in request:
+            return None
+        response["jsonrpc"] = "2.0"
+        response["id"] = request.get("id") if type(request) is dict else None
+        return response
+
+    async def handle_client(self, reader, writer):
+        # requests of one client are answered concurrently, in completion order
+        pending = set()
+        write_lock = asyncio.Lock()
+
+        async def send(response):
+            async with write_lock:
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+
+        async def answer(line):
+            response = await self.handle_line(line)
+            if response is not None:
+                await send(response)
+
+        try:
+            while (line := await read_line(reader)) != b"":
+                if line is None:
+                    message = f"request longer than {self.max_request} bytes"
+                    task = asyncio.create_task(send({"error": {"code": INVALID_REQUEST, "message": message},
+                                                     "jsonrpc": "2.0", "id": None}))
+                elif line.strip():
+                    task = asyncio.create_task(answer(line))
+                else:
+                    continue
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            await asyncio.gather(*pending)
+        finally:
+            writer.close()
+
+    async def serve(self, path):
+        if os.path.exists(path):
+            os.unlink(path)
+        server = await asyncio.start_unix_server(self.handle_client, path=path, limit=self.max_request)
+        print(f"listening on {path}", flush=True)
+        async with server:
+            await server.serve_forever()
+
+
+async def read_line(reader):
+    # the next line, None for a line over the reader's limit, which is
+    # skipped up to its end, and b"" once the client is gone
+    too_long = False
+    while True:
+        try:
+            line = await reader.readuntil(b"\n")
+        except asyncio.IncompleteReadError as e:
+            line = e.partial
+        except asyncio.LimitOverrunError as e:
+            too_long = True
+            await reader.readexactly(e.consumed)
+            continue
+        return None if too_long else line
+
+
+def call(method, socket_path=DEFAULT_SOCKET, **params):
+    # blocking one-shot client for scripts
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        request = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params}
+        s.sendall(json.dumps(request).encode() + b"\n")
+        with s.makefile("rb") as f:
+            response = json.loads(f.readline())
+    if "error" in response:
+        raise RPCError(response["error"]["code"], response["error"]["message"])
+    return response["result"]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="decompiler daemon over a unix socket")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET)
+    parser.add_argument("--max-roms", type=int, default=8, help="analysed ROMs kept in memory")
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(Server(args.max_roms).serve(args.socket))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
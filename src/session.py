@@ -0,0 +1,112 @@
+import sys
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import lexer
+import explorer
+import gb_ast
+from budget import Budget
+from bankcache import BankedTokens
+from regions import RegionTokens
+from signatures import SignatureLibrary
+
+# one decompilation and everything it knows about its ROM image. sessions
+# share no state, any number of them can run at once on different threads.
+# stages run lazily, the first time they are needed, and are dropped
+# together whenever the image changes.
+
+
+class Session:
+    def __init__(self, code, known=None, max_decoded_bytes=None, log=None, limits=None, skip_data=False):
+        # known maps addresses of library routines to their names,
+        # log is called with every debugging line besides keeping it in messages,
+        # limits are the keyword arguments of the Budget every analysis runs under,
+        # skip_data leaves regions classified as data undecoded until they are reached
+        self.code = bytearray(code)
+        self.known = known
+        self.max_decoded_bytes = max_decoded_bytes
+        self.skip_data = skip_data
+        self.limits = limits or {}
+        self.messages = []
+        self._log = log
+        self.lock = threading.RLock()
+        self.reset()
+
+    @classmethod
+    def open(cls, path, **kwargs):
+        with open(path, "rb") as f:
+            return cls(f.read(), **kwargs)
+
+    def reset(self):
+        with self.lock:
+            self._tokens = None
+            self._funcs = None
+            self._ast = None
+            self.budget = Budget(**self.limits)
+
+    def log(self, *args):
+        line = " ".join(str(arg) for arg in args)
+        self.messages.append(line)
+        if self._log:
+            self._log(line)
+
+    @property
+    def tokens(self):
+        with self.lock:
+            if self._tokens is None:
+                if self.skip_data:
+                    self._tokens = RegionTokens(bytes(self.code))
+                elif self.max_decoded_bytes is not None:
+                    self._tokens = BankedTokens(bytes(self.code), self.max_decoded_bytes)
+                else:
+                    self._tokens = lexer.index_code(bytes(self.code))
+            return self._tokens
+
+    @property
+    def funcs(self):
+        with self.lock:
+            if self._funcs is None:
+                self._funcs = explorer.explore(self.tokens, known=self.known, log=self.log, budget=self.budget)
+            return self._funcs
+
+    @property
+    def ast(self):
+        # {name: ASTNode} in exploration order
+        with self.lock:
+            if self._ast is None:
+                self._ast = {func.name: func for func in gb_ast.iter_ast(self.funcs, budget=self.budget)}
+            return self._ast
+
+    def decompile(self):
+        return str(gb_ast.ASTNodeInitial(scope=list(self.ast.values())))
+
+
+def decompile_all(sessions, workers=None):
+    # decompiles every session on a pool of threads, results in the same order
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(Session.decompile, sessions))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="decompile several gb files on a thread pool")
+    parser.add_argument("gb_files", nargs="+")
+    parser.add_argument("--signatures", help="signature library of known routines to skip")
+    parser.add_argument("-t", "--threads", type=int, help="worker threads")
+    args = parser.parse_args(argv)
+
+    library = SignatureLibrary.load(args.signatures) if args.signatures else None
+    sessions = []
+    for gb_file in args.gb_files:
+        session = Session.open(gb_file)
+        if library:
+            session.known = library.scan(bytes(session.code))
+        sessions.append(session)
+
+    for gb_file, text in zip(args.gb_files, decompile_all(sessions, args.threads)):
+        print(f"// {gb_file}")
+        print(text)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
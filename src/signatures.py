@@ -0,0 +1,186 @@
+import os
+import sys
+import json
+import argparse
+from collections import deque
+import lexer
+import explorer
+
+# byte signatures of known library routines (memcpy, memset, joypad reads, ...).
+# a library is a json file: {"signatures": [{"name": ..., "pattern": "2A 12 ?? ?? C9"}]}
+# where "??" masks bytes that differ between builds, e.g. absolute addresses.
+
+MASK = None
+MIN_SIG_LEN = 8
+
+
+def parse_pattern(text):
+    return [MASK if b == "??" else int(b, 16) for b in text.split()]
+
+def format_pattern(pattern):
+    return " ".join("??" if b is MASK else f"{b:02X}" for b in pattern)
+
+def anchor(pattern):
+    # the longest unmasked run of the pattern, as (offset, bytes)
+    best = (0, b"")
+    start = 0
+    for i, b in enumerate(pattern + [MASK]):
+        if b is MASK:
+            if i - start > len(best[1]):
+                best = (start, bytes(pattern[start:i]))
+            start = i + 1
+    return best
+
+
+class AhoCorasick:
+    # multi pattern matcher over bytes, one pass over the haystack
+    def __init__(self, needles):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for key, needle in needles:
+            node = 0
+            for b in needle:
+                if b not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                    self.goto[node][b] = len(self.goto) - 1
+                node = self.goto[node][b]
+            self.out[node].append((key, len(needle)))
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for b, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f and b not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[child] = self.goto[f].get(b, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def search(self, haystack):
+        # yields (key, start) of every needle occurrence
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for i, b in enumerate(haystack):
+            while node and b not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(b, 0)
+            for key, length in out[node]:
+                yield key, i - length + 1
+
+
+class SignatureLibrary:
+    def __init__(self, sigs=()):
+        # [(name, pattern)]
+        self.sigs = list(sigs)
+        self._patterns = {tuple(pattern) for _, pattern in self.sigs}
+        self._matcher = None
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls((s["name"], parse_pattern(s["pattern"])) for s in data["signatures"])
+
+    def save(self, path):
+        sigs = [{"name": name, "pattern": format_pattern(pattern)} for name, pattern in self.sigs]
+        with open(path, "w") as f:
+            json.dump({"signatures": sigs}, f, indent=1)
+
+    def add(self, name, pattern):
+        if tuple(pattern) in self._patterns:
+            return False
+        self._patterns.add(tuple(pattern))
+        self.sigs.append((name, pattern))
+        self._matcher = None
+        return True
+
+    def matcher(self):
+        if self._matcher is None:
+            anchors = []
+            for i, (_, pattern) in enumerate(self.sigs):
+                off, needle = anchor(pattern)
+                if needle:
+                    anchors.append(((i, off), needle))
+            self._matcher = AhoCorasick(anchors)
+        return self._matcher
+
+    def scan(self, code):
+        # returns {rom offset: name} of every full pattern match.
+        # a routine found at several offsets gets the offset appended to its name.
+        found = {}
+        for (i, off), pos in self.matcher().search(code):
+            name, pattern = self.sigs[i]
+            start = pos - off
+            if start < 0 or start + len(pattern) > len(code) or start in found:
+                continue
+            if all(p is MASK or p == code[start + k] for k, p in enumerate(pattern)):
+                found[start] = name
+        names = {}
+        for start, name in found.items():
+            names.setdefault(name, []).append(start)
+        return {start: name if len(starts) == 1 else f"{name}_{start:04X}"
+                for name, starts in names.items() for start in starts}
+
+
+def func_ranges(tokens, pc_start=0x100):
+    # (start, length) of every function reachable from the entry point.
+    # length includes the final RET.
+    graph = explorer.call_graph(tokens, pc_start)
+    for start, (length, _) in list(graph.items())[1:]:
+        yield start, length + 1
+
+
+def make_pattern(code, tokens, start, length):
+    # the function bytes with every absolute address operand masked
+    pattern = list(code[start:start+length])
+    for inst, pc in explorer.make_slice(tokens, start, length):
+        if type(inst) in explorer.ABS_ADDR_INSTS:
+            pattern[pc - start + 1] = MASK
+            pattern[pc - start + 2] = MASK
+    return pattern
+
+
+def build(library, gb_file):
+    with open(gb_file, "rb") as f:
+        code = f.read()
+    tokens = lexer.index_code(code)
+    prefix = os.path.splitext(os.path.basename(gb_file))[0]
+    added = 0
+    for start, length in func_ranges(tokens):
+        if length < MIN_SIG_LEN:
+            continue
+        added += library.add(f"{prefix}_{start:04X}", make_pattern(code, tokens, start, length))
+    return added
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="byte signatures of known routines")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("build", help="add the functions of analysed ROMs to a library")
+    p.add_argument("library")
+    p.add_argument("gb_files", nargs="+")
+    p = sub.add_parser("scan", help="find library routines in a ROM")
+    p.add_argument("library")
+    p.add_argument("gb_file")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "build":
+        library = SignatureLibrary.load(args.library) if os.path.exists(args.library) else SignatureLibrary()
+        for gb_file in args.gb_files:
+            print(f"{gb_file}: {build(library, gb_file)} new signatures")
+        library.save(args.library)
+    else:
+        library = SignatureLibrary.load(args.library)
+        with open(args.gb_file, "rb") as f:
+            code = f.read()
+        for start, name in sorted(library.scan(code).items()):
+            print(f"${start:04X}: {name}")
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -40,6 +40,31 @@ def create_initial_regmap():
         "Stack": []
     }
 
+def create_func_regmap():
+    # nothing is known about the registers a function is called with
+    regmap = {reg: reg for reg in ["A", "B", "C", "D", "E", "F", "H", "L"]}
+    regmap["Stack"] = []
+    return regmap
+
+ALU_SYMBOLS = {"ADD": "+", "ADC": "+", "SUB": "-", "SBC": "-", "AND": "&", "XOR": "^", "OR": "|"}
+REGS8 = ["A", "B", "C", "D", "E", "H", "L"]
+
+def clobber(regmap, regs):
+    # values that can no longer be followed are named after their register
+    for reg in regs:
+        regmap[reg] = reg
+
+def reg_pair(reg):
+    # "BC" -> ("B", "C"), None for SP
+    return (reg[0], reg[1]) if reg[:2] in {"BC", "DE", "HL", "AF"} else None
+
+def alu_dry_run(op, regmap, operand):
+    # CP and the flag only ops leave A alone
+    if op in ALU_SYMBOLS:
+        regmap["A"] = Expr(ALU_SYMBOLS[op], regmap["A"], operand)
+    return None
+
+
 class Instruction(ABC):
 
     def __init__(self, op:str, regl:str=None, regr:str=None, *, imm:int=0, addr:int=0, cond:str=""):
@@ -115,7 +140,7 @@ class InstFamilyStoreReg(Instruction):
         return super().__init__(op, regl, regr)
 
     def __str__(self):
-        return f"{self.op} ({self.regl}), {self.reg}"
+        return f"{self.op} ({self.regl}), {self.regr}"
 
 
 class InstFamilyLoadReg(Instruction):
@@ -139,7 +164,7 @@ class InstFamilyLoadAddr(Instruction):
         return super().__init__(op, regl=reg, addr=addr)
 
     def __str__(self):
-        return f"{self.op} {self.regr}, (${self.addr:04x})"
+        return f"{self.op} {self.regl}, (${self.addr:04x})"
 
 
 class InstFamilyStoreImm(Instruction):
@@ -161,23 +186,42 @@ class InstFamilyCondition(Instruction):
 
 class InstALUregSP(InstFamilyRegWithImmediate):
     # NOTE: a rare command (E8h), barely used
-    pass
+    def dry_run(self, regmap):
+        return None
 
 
 class InstALU(InstFamilyTwoRegs):
-    pass
+    def dry_run(self, regmap):
+        if self.op in {"XOR", "SUB"} and self.regr == "A":
+            regmap["A"] = "$00"
+            return None
+        if self.op in {"RLCA", "RLA"}:
+            regmap["A"] = Expr("<<", regmap["A"], "1")
+        elif self.op in {"RRCA", "RRA"}:
+            regmap["A"] = Expr(">>", regmap["A"], "1")
+        elif self.op == "CPL":
+            regmap["A"] = Expr("~", regmap["A"])
+        elif self.op == "DAA":
+            clobber(regmap, ["A"])
+        else:
+            return alu_dry_run(self.op, regmap, regmap[self.regr])
+        return None
 
 
 class InstALU16bit(InstFamilyTwoRegs):
-    pass
+    def dry_run(self, regmap):
+        clobber(regmap, reg_pair(self.regl) or [])
+        return None
 
 
 class InstALUDirect(InstFamilyLoadReg):
-    pass
+    def dry_run(self, regmap):
+        return alu_dry_run(self.op, regmap, "*HL")
 
 
 class InstALUImmediate(InstFamilyRegWithImmediate):
-    pass
+    def dry_run(self, regmap):
+        return alu_dry_run(self.op, regmap, f"${self.imm:02x}")
 
 
 class InstIncDec(InstFamilySingleReg):
@@ -191,19 +235,29 @@ class InstIncDec(InstFamilySingleReg):
 
 
 class InstIncDecDirect(InstFamilyDirect):
-    pass
+    def dry_run(self, regmap):
+        sign = "+" if self.op.upper() == "INC" else "-"
+        return Expr(":=", "*HL", Expr(sign, "*HL", "1"))
 
 
 class InstIncDec16bit(InstFamilySingleReg):
-    pass
+    def dry_run(self, regmap):
+        clobber(regmap, reg_pair(self.regl) or [])
+        return None
 
 
 class InstCBPrefixDirect(InstFamilyDirect):
-    pass
+    def dry_run(self, regmap):
+        return None
 
 
 class InstCBPrefix(InstFamilySingleReg):
-    pass
+    def dry_run(self, regmap):
+        # β8-β15 are the BIT tests, everything else rewrites the register
+        beta = int(self.op[1:])
+        if not 8 <= beta < 16:
+            clobber(regmap, [self.regl])
+        return None
 
 
 class InstRelJumpConditional(InstFamilyCondition):
@@ -212,9 +266,13 @@ class InstRelJumpConditional(InstFamilyCondition):
             addr = addr - 256
         return super().__init__(op, cond=cond, addr=addr)
 
+    def dry_run(self, regmap):
+        return None
+
 
 class InstAbsJumpConditional(InstFamilyCondition):
-    pass
+    def dry_run(self, regmap):
+        return None
 
 
 class InstRelJump(InstFamilyAddr):
@@ -237,24 +295,30 @@ class InstPush(InstFamilyTwoRegs):
         super().__init__(op, regl=highreg, regr=lowreg)
 
     def dry_run(self, regmap):
-        regmap["Stack"].append((self.regl, self.regr))
+        regmap["Stack"].append((regmap[self.regl], regmap[self.regr]))
 
 class InstPop(InstFamilyTwoRegs):
     def __init__(self, op, highreg, lowreg):
         super().__init__(op, regl=highreg, regr=lowreg)
 
     def dry_run(self, regmap):
+        if not regmap["Stack"]:
+            # pushed by a caller
+            clobber(regmap, [self.regl, self.regr])
+            return None
         l, r = regmap["Stack"][-1]
         regmap["Stack"] = regmap["Stack"][:-1]
-        regmap[self.regl] = regmap[l]
-        regmap[self.regr] = regmap[r]
+        regmap[self.regl] = l
+        regmap[self.regr] = r
 
 
 class InstLoadImmediate16bit(InstFamilyRegWithImmediate):
     def dry_run(self, regmap):
-        assert self.reg in regmap
-        regmap[self.reg] = self.imm
-
+        pair = reg_pair(self.regl)
+        if pair:
+            high, low = pair
+            regmap[high] = f"${self.imm >> 8:02x}"
+            regmap[low] = f"${self.imm & 0xff:02x}"
         return None
 
 class InstLoadImmediate(InstFamilyRegWithImmediate):
@@ -264,7 +328,9 @@ class InstLoadImmediate(InstFamilyRegWithImmediate):
         return None
 
 class InstLoadDirect(InstFamilyLoadReg):
-    pass
+    def dry_run(self, regmap):
+        regmap[self.regl] = f"*{self.regr}"
+        return None
 
 
 class InstLoadRegToReg(InstFamilyTwoRegs):
@@ -273,19 +339,27 @@ class InstLoadRegToReg(InstFamilyTwoRegs):
         return None
 
 class InstLoadRegToHL(InstFamilyStoreReg):
-    pass
+    def dry_run(self, regmap):
+        return Expr(":=", "*HL", regmap[self.regr])
 
 
 class InstLoadHLToReg(InstFamilyLoadReg):
-    pass
+    def dry_run(self, regmap):
+        regmap[self.regl] = "*HL"
+        return None
 
 
 class InstLoadRegToHLI(InstFamilyStoreReg):
-    pass
+    def dry_run(self, regmap):
+        clobber(regmap, ["H", "L"])
+        return Expr(":=", "*HL", regmap[self.regr])
 
 
 class InstLoadHLIToReg(InstFamilyLoadReg):
-    pass
+    def dry_run(self, regmap):
+        regmap[self.regl] = "*HL"
+        clobber(regmap, ["H", "L"])
+        return None
 
 
 class InstLoadImmediateDirect(Instruction):
@@ -294,14 +368,20 @@ class InstLoadImmediateDirect(Instruction):
 
     def __str__(self):
         return f"{self.op} ({self.regl}), {self.imm:02x}"
-    
+
+    def dry_run(self, regmap):
+        return Expr(":=", "*HL", f"${self.imm:02x}")
+
 
 class InstLoad16bit(InstFamilyLoadReg):
-    pass
+    def dry_run(self, regmap):
+        regmap[self.regl] = f"*{self.regr}"
+        return None
 
 
 class InstStore16bit(InstFamilyStoreReg):
-    pass
+    def dry_run(self, regmap):
+        return Expr(":=", f"*{self.regl}", regmap[self.regr])
 
 
 class InstLoadAddr(InstFamilyLoadAddr):
@@ -319,23 +399,39 @@ class InstStoreAddr(InstFamilyStoreAddr):
 
 
 class InstHighLoad(InstFamilyLoadAddr):
-    pass
+    def dry_run(self, regmap):
+        regmap[self.regl] = f"*$ff{self.addr:02x}"
+        return None
 
 
 class InstHighStore(InstFamilyStoreAddr):
-    pass
+    def dry_run(self, regmap):
+        # NOTE: the lexer builds "LDH A, (a8)" as a store as well
+        if "load" in self.op:
+            regmap[self.regr] = f"*$ff{self.addr:02x}"
+            return None
+        return Expr(":=", f"$ff{self.addr:02x}", regmap[self.regr])
 
 
 class InstHighCStore(InstFamilyStoreReg):
-    pass
+    def dry_run(self, regmap):
+        # NOTE: the lexer builds "LDH A, (C)" as a store as well
+        if self.op.endswith("(C)"):
+            regmap["A"] = "*($ff00+C)"
+            return None
+        return Expr(":=", "*($ff00+C)", regmap["A"])
 
 
 class InstHighCLoad(InstFamilyLoadReg):
-    pass
+    def dry_run(self, regmap):
+        regmap["A"] = "*($ff00+C)"
+        return None
 
 
 class InstReset(InstFamilyRegWithImmediate):
-    pass
+    def dry_run(self, regmap):
+        clobber(regmap, REGS8)
+        return f"rst_{self.imm:02X}()"
 
 
 class InstControl(InstFamilyOpOnly):
@@ -343,22 +439,31 @@ class InstControl(InstFamilyOpOnly):
         if self.op.upper() == "NOP":
             return None
 
-        raise Exception(f"unimplemented dry run for op '{self.op}'")
+        return f"{self.op.lower()}()"
 
 class InstCall(InstFamilyAddr):
-    pass
+    def dry_run(self, regmap):
+        # the callee may leave anything in the registers
+        clobber(regmap, REGS8)
+        return f"fun_{self.addr:04X}()"
 
 
 class InstRet(InstFamilyOpOnly):
-    pass
+    def dry_run(self, regmap):
+        return "return"
 
 
 class InstConitionalRet(InstFamilyCondition):
     def __str__(self):
         return f"{self.op} {self.cond}"
 
+    def dry_run(self, regmap):
+        return f"if({self.cond}) return"
+
 
 class InstConitionalCall(InstFamilyCondition):
-    pass
+    def dry_run(self, regmap):
+        clobber(regmap, REGS8)
+        return f"if({self.cond}) fun_{self.addr:04X}()"
 
 
@@ -0,0 +1,103 @@
+import unittest
+import lexer
+import absint
+import explorer
+import gb_ast
+from explorer import make_slice
+
+A, B = absint.IDX["A"], absint.IDX["B"]
+
+
+def analyse(code, **kwargs):
+    tokens = lexer.tokenize_code(code)
+    return absint.FunctionAnalysis(make_slice(tokens, 0, len(code) - 1), **kwargs).run()
+
+
+def decompile(body):
+    # fun_0200 of an image whose main calls it
+    code = bytearray(0x8000)
+    code[0x100:0x103] = b"\xC3\x50\x01"             # jp $0150
+    code[0x150:0x155] = b"\xCD\x00\x02\x18\xFE"     # call $0200; jr @
+    code[0x200:0x200 + len(body)] = body
+    funcs = explorer.explore(lexer.tokenize_code(bytes(code)))
+    return str(list(gb_ast.iter_ast(funcs))[1])
+
+
+class IntervalTest(unittest.TestCase):
+    def test_join(self):
+        self.assertEqual(absint.join_iv((1, 1), (5, 5)), (1, 5))
+        a = absint.top_state()[:A] + ((2, 3),) + absint.top_state()[B:absint.ZREG] + ("A",)
+        b = absint.top_state()[:A] + ((7, 7),) + absint.top_state()[B:absint.ZREG] + ("B",)
+        joined = absint.join(a, b)
+        self.assertEqual(joined[A], (2, 7))
+        self.assertIsNone(joined[absint.ZREG])
+        self.assertEqual(absint.join(None, a), a)
+
+    def test_widen(self):
+        # a bound still moving goes to the end of the domain, a stable one stays
+        self.assertEqual(absint.widen_iv((0, 3), (0, 4)), (0, 0xFF))
+        self.assertEqual(absint.widen_iv((2, 5), (1, 5)), (0, 5))
+        self.assertEqual(absint.widen_iv((2, 5), (3, 4)), (2, 5))
+
+    def test_loop_converges(self):
+        # xor a; L: inc a; jr nz,L; ret
+        fa = analyse(b"\xAF\x3C\x20\xFD\xC9")
+        self.assertTrue(fa.converged)
+        self.assertEqual(fa.state_before(1)[A], absint.TOP)
+        self.assertEqual(fa.state_after(2)[A], (0, 0))
+
+    def test_max_steps(self):
+        # out of steps every block knows nothing, which is sound
+        fa = analyse(b"\xAF\x3C\x20\xFD\xC9", max_steps=1)
+        self.assertFalse(fa.converged)
+        self.assertEqual(set(fa.states.values()), {absint.top_state()})
+
+
+class BankTest(unittest.TestCase):
+    def test_bank_select(self):
+        # ld a,3; ld [$2000],a; call $1000; ret
+        fa = analyse(b"\x3E\x03\xEA\x00\x20\xCD\x00\x10\xC9")
+        self.assertEqual(fa.state_before(0)[absint.BANK], absint.BANK_TOP)
+        self.assertEqual(fa.state_after(2)[absint.BANK], (3, 3))
+        # the callee may select another bank
+        self.assertEqual(fa.state_after(5)[absint.BANK], absint.BANK_TOP)
+
+    def test_bank_select_through_hl(self):
+        # ld hl,$2100; ld [hl],5; ret
+        fa = analyse(b"\x21\x00\x21\x36\x05\xC9")
+        self.assertEqual(fa.state_after(3)[absint.BANK], (5, 5))
+
+
+class ZeroFlagTest(unittest.TestCase):
+    def test_flag_kept_by_branch(self):
+        # ld b,2; L: dec b; jr nz,L; ret
+        fa = analyse(b"\x06\x02\x05\x20\xFD\xC9")
+        self.assertEqual(fa.state_after(3)[B], (0, 0))
+
+    def test_overwritten_register(self):
+        # ld b,1; L: dec b; ld b,5; jr nz,L; ret
+        # the flag belongs to the old B, the jump can be taken or not
+        fa = analyse(b"\x06\x01\x05\x06\x05\x20\xFB\xC9")
+        self.assertIsNotNone(fa.state_after(5))
+        self.assertEqual(fa.state_after(5)[B], (5, 5))
+
+
+class FixUpTest(unittest.TestCase):
+    def test_after_loop(self):
+        # ld b,3; L: dec b; jr nz,L; ld a,b; ld [$C000],a; ret
+        self.assertIn("($c000):=($00)", decompile(b"\x06\x03\x05\x20\xFD\x78\xEA\x00\xC0\xC9"))
+
+    def test_after_if(self):
+        # ld a,5; cp 4; jr z,+2; ld a,1; ld [$C000],a; ret
+        # A is 1 or 5 after the IF, not the 1 of the path the dry run took
+        text = decompile(b"\x3E\x05\xFE\x04\x28\x02\x3E\x01\xEA\x00\xC0\xC9")
+        self.assertIn("($c000):=A", text)
+        self.assertNotIn("($01)", text)
+
+    def test_after_if_same_value(self):
+        # ld a,5; cp 4; jr z,+2; ld a,5; ld [$C000],a; ret
+        self.assertIn("($c000):=($05)", decompile(b"\x3E\x05\xFE\x04\x28\x02\x3E\x05\xEA\x00\xC0\xC9"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import time
+import unittest
+import lexer
+import explorer
+from budget import Budget, BudgetExceeded
+
+CALLEE_LEN = 75
+DELAY = 0.001
+
+
+def rom():
+    code = bytearray(0x3000)
+    code[0x100:0x103] = b"\xC3\x50\x01"                 # jp $0150
+    code[0x150:0x155] = b"\xCD\x00\x05\x18\xFE"         # call $0500; jr @
+    code[0x500:0x507] = b"\xCD\x00\x10\xCD\x00\x20\xC9" # call $1000; call $2000; ret
+    code[0x1000 + CALLEE_LEN] = 0xC9
+    code[0x2000 + CALLEE_LEN + 1] = 0xC9
+    return bytes(code)
+
+
+class SlowTokens(dict):
+    # every look at the callees takes a while, so that they cost wall time
+    def get(self, pc, default=None):
+        if 0x1000 <= pc < 0x3000:
+            time.sleep(DELAY)
+        return super().get(pc, default)
+
+
+class BudgetTest(unittest.TestCase):
+    def test_steps(self):
+        b = Budget(steps=10)
+        b.step(10)
+        with self.assertRaises(BudgetExceeded):
+            b.step()
+        self.assertTrue(b.exhausted)
+
+    def test_func_charges_parent(self):
+        b = Budget(steps=10, func_steps=8)
+        f = b.func()
+        f.step(5)
+        g = b.func()
+        with self.assertRaises(BudgetExceeded):
+            g.step(6)
+        self.assertEqual(b.used, 11)
+        self.assertTrue(g.exhausted)
+
+    def test_pause(self):
+        b = Budget(seconds=0.05)
+        b.step()
+        b.pause()
+        time.sleep(0.1)
+        b.step(2)
+        self.assertFalse(b.exhausted)
+
+    def test_callees_not_charged_to_caller(self):
+        # each callee takes about 0.3 seconds, the caller only waits for them
+        tokens = SlowTokens(lexer.tokenize_code(rom()))
+        funcs = explorer.explore(tokens, budget=Budget(func_seconds=0.5))
+        self.assertEqual(set(funcs), {"main", "fun_0500", "fun_1000", "fun_2000"})
+        for name, content in funcs.items():
+            self.assertNotEqual(type(content), dict, name)
+
+
+if __name__ == '__main__':
+    unittest.main()
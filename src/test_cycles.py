@@ -0,0 +1,39 @@
+import unittest
+import lexer
+import explorer
+import cycles
+import gb_ast
+from test_session import rom
+
+
+class CyclesTest(unittest.TestCase):
+    def setUp(self):
+        self.code = rom()
+        self.funcs = explorer.explore(lexer.tokenize_code(self.code))
+
+    def test_functions_include_ret(self):
+        func_costs, _ = cycles.rank(self.code, self.funcs)
+        costs = {name: (lo, hi) for hi, lo, name in func_costs}
+        # ld a,n 8 + ldh (n),a 12 + call 24 + ret 16
+        self.assertEqual(costs["fun_0800"], (60, 60))
+        # cp n 8, then jr z taken 12, or not taken 8 and ld a,n 8, then ret 16
+        self.assertEqual(costs["fun_0700"], (36, 40))
+
+    def test_loop_iteration(self):
+        _, loops = cycles.content_cycles(self.code, self.funcs["fun_0600"])
+        # dec b 4 + jr nz taken 12
+        self.assertEqual(loops, {0x0603: (16, 16)})
+
+    def test_ast_comments(self):
+        funcs = {f.name: f for f in gb_ast.iter_ast(self.funcs, code=self.code)}
+        self.assertEqual(funcs["fun_0800"].cycles, (60, 60))
+        self.assertIn("while(A == 0) { // 16 cycles", str(funcs["fun_0600"]))
+
+    def test_cb_prefix(self):
+        self.assertEqual(cycles.inst_cycles(b"\xCB\x46", 0), (12, 12))   # bit 0,[hl]
+        self.assertEqual(cycles.inst_cycles(b"\xCB\x86", 0), (16, 16))   # res 0,[hl]
+        self.assertEqual(cycles.inst_cycles(b"\xCB\x11", 0), (8, 8))     # rl c
+
+
+if __name__ == '__main__':
+    unittest.main()
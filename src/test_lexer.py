@@ -0,0 +1,61 @@
+import random
+import unittest
+import lexer
+import explorer
+
+
+class ParallelTest(unittest.TestCase):
+    def test_same_as_serial(self):
+        # random bytes leave plenty of instructions running over bank ends
+        rnd = random.Random(0)
+        code = bytes(rnd.randrange(256) for _ in range(3 * lexer.BANK_SIZE - 4)) + b"\x00" * 4
+        serial = lexer.tokenize_code(code)
+        parallel = lexer.tokenize_code_parallel(code, 2)
+        self.assertEqual(list(parallel), list(serial))
+        for pc, inst in serial.items():
+            self.assertIs(type(parallel[pc]), type(inst))
+            self.assertEqual(str(parallel[pc]), str(inst))
+        self.assertNotIn(max(serial) + 1, parallel)
+
+
+class PeakTokens(lexer.LazyTokens):
+    # keeps the most instructions that were ever decoded at once
+    peak = 0
+
+    def get(self, pc, default=None):
+        inst = super().get(pc, default)
+        self.peak = max(self.peak, len(self.decoded))
+        return inst
+
+
+class OnDemandTest(unittest.TestCase):
+    def test_same_as_tokenize_code(self):
+        rnd = random.Random(1)
+        code = bytes(rnd.randrange(256) for _ in range(0x8000 - 4)) + b"\x00" * 4
+        serial = lexer.tokenize_code(code)
+        tokens = lexer.index_code(code)
+        self.assertEqual(list(tokens), list(serial))
+        self.assertEqual([str(inst) for _, inst in tokens.items()], [str(inst) for inst in serial.values()])
+        self.assertEqual(tokens.decoded, {})
+
+    def test_cut_off_instruction(self):
+        # the call at the end has one byte of its address only
+        self.assertEqual(list(lexer.index_code(b"\x00\x00\xCD\x00")), [0, 1])
+
+    def test_one_function_at_a_time(self):
+        # main calls 8 functions of 64 nops each, the image is full of code besides
+        code = bytearray(0x8000)
+        code[0x100:0x103] = b"\xC3\x50\x01"
+        calls = [0x1000 + 0x100 * i for i in range(8)]
+        main = b"".join(b"\xCD" + c.to_bytes(2, "little") for c in calls) + b"\x18\xFE"
+        code[0x150:0x150 + len(main)] = main
+        for c in calls:
+            code[c + 64] = 0xC9
+        tokens = PeakTokens(bytes(code), lexer.inst_starts(bytes(code)))
+        funcs = explorer.explore(tokens)
+        self.assertEqual(len(funcs), 9)
+        self.assertLessEqual(tokens.peak, 65)
+
+
+if __name__ == '__main__':
+    unittest.main()
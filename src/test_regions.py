@@ -0,0 +1,50 @@
+import random
+import unittest
+import numpy as np
+import lexer
+from regions import RegionTokens, WINDOW, classify
+
+
+def image(windows):
+    # random bytes, with room for the last instruction
+    rnd = random.Random(0)
+    return bytes(rnd.randrange(256) for _ in range(windows * WINDOW - 4)) + b"\x00" * 4
+
+
+def code_like(size):
+    # a few common opcodes and no invalid ones
+    rnd = random.Random(0)
+    return bytes(rnd.choice(b"\x3E\x06\x05\x20\xC9\x21\x77\x23\x78\xFE\xAF\x0E") for _ in range(size))
+
+
+class RegionTokensTest(unittest.TestCase):
+    def setUp(self):
+        # code and data windows taking turns, the classifier is not asked
+        self.code = image(8)
+        self.is_data = np.array([w % 2 == 1 for w in range(8)])
+        self.tokens = RegionTokens(self.code, self.is_data)
+
+    def test_code_windows(self):
+        for w in range(0, 8, 2):
+            start = w * WINDOW
+            expected = dict(lexer.iter_tokens(self.code[start:], start, start + WINDOW))
+            for pc, inst in expected.items():
+                self.assertEqual(str(self.tokens.get(pc)), str(inst))
+        self.assertEqual(self.tokens.decoded, 4 * WINDOW)
+
+    def test_data_window_on_demand(self):
+        w = 3
+        start = self.tokens.pending[w]
+        self.assertEqual(len(self.tokens.pending), 4)
+        inst = self.tokens[start]
+        self.assertEqual(str(inst), str(next(lexer.iter_tokens(self.code[start:], start))[1]))
+        self.assertEqual(self.tokens.decoded, 5 * WINDOW)
+        self.assertNotIn(w, self.tokens.pending)
+
+    def test_classify(self):
+        code = code_like(WINDOW) + b"\xFF" * WINDOW + image(1) + code_like(WINDOW)
+        self.assertEqual(classify(code).tolist(), [False, True, True, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
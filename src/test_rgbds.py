@@ -0,0 +1,43 @@
+import io
+import unittest
+import rgbds
+
+
+def rom(entry):
+    code = bytearray(0x8000)
+    code[0x100:0x100 + len(entry)] = entry
+    code[0x104:0x106] = b"\xCE\xED"     # start of the logo
+    code[0x150:0x153] = b"\xC3\x50\x01" # jp $0150
+    return bytes(code)
+
+
+def export(code):
+    out = io.StringIO()
+    rgbds.export(code, out)
+    return out.getvalue()
+
+
+class ImageTest(unittest.TestCase):
+    def test_every_byte_once(self):
+        for entry in (b"\x00\xC3\x50\x01", b"\x00\x00\x00\xC3", b"\x00\x00\xCD\x00"):
+            code = rom(entry)
+            pc = 0
+            for start, _, length in rgbds.iter_image(code):
+                self.assertEqual(start, pc)
+                pc += length
+            self.assertEqual(pc, len(code))
+
+    def test_entry_point(self):
+        text = export(rom(b"\x00\xC3\x50\x01"))
+        self.assertIn("\tnop\n\tjp lbl_0150\n", text)
+
+    def test_instruction_running_into_header(self):
+        # the jp at $0103 would take the first two header bytes as its address
+        text = export(rom(b"\x00\x00\x00\xC3"))
+        self.assertNotIn("jp $EDCE", text)
+        self.assertIn("\tdb $C3, $CE, $ED, $00", text)
+        self.assertEqual(text.count("$CE, $ED"), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+import romdiff
+from test_session import rom
+
+
+class DiffTest(unittest.TestCase):
+    def test_unchanged(self):
+        res = romdiff.diff(rom(), rom())
+        self.assertEqual(res["changed"], [])
+        self.assertEqual(res["unchanged"], 4)
+
+    def test_changed_ast(self):
+        res = romdiff.diff(rom(), rom(value=0x91))
+        (name_a, name_b, lines), = res["changed"]
+        self.assertEqual((name_a, name_b), ("fun_0800", "fun_0800"))
+        self.assertIn("+    ($ff40):=($91)", lines)
+
+    def test_change_the_ast_does_not_show(self):
+        # the loop counter of fun_0600 is not part of its AST
+        code = bytearray(rom())
+        code[0x601] = 4
+        res = romdiff.diff(rom(), bytes(code))
+        (name_a, _, lines), = res["changed"]
+        self.assertEqual(name_a, "fun_0600")
+        self.assertIn("-$0600  LD B, $0003", lines)
+        self.assertIn("+$0600  LD B, $0004", lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import json
+import asyncio
+import tempfile
+import unittest
+import server
+from test_session import rom
+
+
+class BrokenServer(server.Server):
+    async def rpc_broken(self, rom):
+        return len(rom) + None
+
+
+class HandleLineTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".gb")
+        with os.fdopen(fd, "wb") as f:
+            f.write(rom())
+        self.server = BrokenServer()
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def call(self, request):
+        line = request if type(request) is str else json.dumps(request)
+        return asyncio.run(self.server.handle_line(line))
+
+    def test_request(self):
+        res = self.call({"jsonrpc": "2.0", "id": 7, "method": "list_functions", "params": [self.path]})
+        self.assertEqual(res["id"], 7)
+        self.assertEqual(res["result"], ["main", "fun_0600", "fun_0700", "fun_0800"])
+
+    def test_xrefs(self):
+        res = self.call({"jsonrpc": "2.0", "id": 1, "method": "xrefs", "params": [self.path, "$FF40"]})
+        self.assertEqual(res["result"], [{"src": 0x0802, "kind": "write", "funcs": ["fun_0800"]}])
+
+    def test_notification(self):
+        # runs, but is not answered, not even when it fails
+        res = self.call({"jsonrpc": "2.0", "method": "patch", "params": [self.path, 0x801, "91"]})
+        self.assertIsNone(res)
+        self.assertEqual(self.server.get(self.path).code[0x801], 0x91)
+        self.assertIsNone(self.call({"jsonrpc": "2.0", "method": "no_such_method"}))
+
+    def test_null_id(self):
+        res = self.call({"jsonrpc": "2.0", "id": None, "method": "unload", "params": [self.path]})
+        self.assertEqual(res, {"result": False, "jsonrpc": "2.0", "id": None})
+
+    def test_invalid_params(self):
+        for params in ([], [self.path, 1, 2], {"rom": self.path, "extra": 1}, 5):
+            res = self.call({"jsonrpc": "2.0", "id": 1, "method": "list_functions", "params": params})
+            self.assertEqual(res["error"]["code"], server.INVALID_PARAMS, params)
+
+    def test_type_error_inside(self):
+        # a bug in the analysis is no fault of the params
+        res = self.call({"jsonrpc": "2.0", "id": 1, "method": "broken", "params": [self.path]})
+        self.assertEqual(res["error"]["code"], server.SERVER_ERROR)
+        self.assertIn("TypeError", res["error"]["message"])
+
+    def test_parse_error(self):
+        res = self.call("{")
+        self.assertEqual(res["error"]["code"], server.PARSE_ERROR)
+        self.assertIsNone(res["id"])
+
+
+class ClientTest(unittest.TestCase):
+    def test_line_over_limit(self):
+        # answered with an error, the connection stays usable
+        async def run(path):
+            srv = server.Server(max_request=1024)
+            listener = await asyncio.start_unix_server(srv.handle_client, path=path, limit=srv.max_request)
+            async with listener:
+                reader, writer = await asyncio.open_unix_connection(path)
+                big = {"jsonrpc": "2.0", "id": 1, "method": "unload", "params": ["x" * 5000]}
+                small = {"jsonrpc": "2.0", "id": 2, "method": "unload", "params": ["x"]}
+                writer.write(json.dumps(big).encode() + b"\n" + json.dumps(small).encode() + b"\n")
+                await writer.drain()
+                first = json.loads(await reader.readline())
+                second = json.loads(await reader.readline())
+                writer.close()
+                return first, second
+
+        with tempfile.TemporaryDirectory() as tmp:
+            first, second = asyncio.run(run(os.path.join(tmp, "sock")))
+        self.assertEqual(first["error"]["code"], server.INVALID_REQUEST)
+        self.assertIsNone(first["id"])
+        self.assertEqual(second, {"result": False, "jsonrpc": "2.0", "id": 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from session import Session, decompile_all
+from server import Analysis
+
+THREADS = 16
+VALUE = 0x801       # immediate of the load in fun_0800 of rom()
+
+
+def rom(value=0x10):
+    code = bytearray(0x8000)
+    code[0x100:0x103] = b"\xC3\x50\x01"                     # jp $0150
+    code[0x150:0x15C] = (b"\xCD\x00\x06"                    # call $0600
+                         b"\xCD\x00\x07"                    # call $0700
+                         b"\xCD\x00\x08"                    # call $0800
+                         b"\x18\xFE\x00")                   # jr @
+    code[0x600:0x606] = b"\x06\x03\x05\x20\xFD\xC9"   # ld b,3; L: dec b; jr nz,L; ret
+    code[0x700:0x707] = b"\xFE\x04\x28\x02\x3E\x01\xC9"     # cp 4; jr z,+2; ld a,1; ret
+    code[0x800:0x808] = bytes([0x3E, value]) + b"\xE0\x40\xCD\x00\x06\xC9"  # ld a,value; ldh ($40),a; call $0600; ret
+    return bytes(code)
+
+
+class ConcurrentSessionTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.roms = [rom(), rom(value=0x91), rom(value=0x22)]
+        cls.serial = [Session(code).decompile() for code in cls.roms]
+
+    def setUp(self):
+        # switch threads as often as possible so that races show up
+        self.interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+
+    def tearDown(self):
+        sys.setswitchinterval(self.interval)
+
+    def test_serial_outputs_differ(self):
+        self.assertEqual(len(set(self.serial)), len(self.roms))
+
+    def test_many_sessions(self):
+        sessions = [Session(self.roms[i % len(self.roms)]) for i in range(4 * THREADS)]
+        out = decompile_all(sessions, THREADS)
+        for i, text in enumerate(out):
+            self.assertEqual(text, self.serial[i % len(self.roms)])
+
+    def test_shared_session(self):
+        shared = Session(self.roms[0])
+        out = decompile_all([shared] * (4 * THREADS), THREADS)
+        self.assertEqual(set(out), {self.serial[0]})
+
+    def test_patch_and_reset_racing_with_ast(self):
+        # every decompilation must match one of the two images in full,
+        # never a mix of stages built before and after a patch
+        fd, path = tempfile.mkstemp(suffix=".gb")
+        with os.fdopen(fd, "wb") as f:
+            f.write(self.roms[0])
+        try:
+            analysis = Analysis(path)
+            expected = {self.serial[0], self.serial[1]}
+
+            def work(i):
+                if i % 4 == 0:
+                    analysis.patch(VALUE, bytes([0x10 if i % 8 else 0x91]))
+                elif i % 4 == 1:
+                    analysis.reset()
+                return str(analysis.decompile())
+
+            with ThreadPoolExecutor(THREADS) as pool:
+                out = list(pool.map(work, range(8 * THREADS)))
+            self.assertLessEqual(set(out), expected)
+            analysis.patch(VALUE, b"\x91")
+            self.assertEqual(analysis.decompile(), self.serial[1])
+        finally:
+            os.unlink(path)
+
+    def test_threads_do_not_share_state(self):
+        # sessions running at once keep their own messages and budgets
+        sessions = [Session(code, limits={"steps": 10**6}) for code in self.roms]
+        barrier = threading.Barrier(len(sessions))
+
+        def work(s):
+            barrier.wait()
+            return s.decompile(), s.budget.used
+
+        with ThreadPoolExecutor(len(sessions)) as pool:
+            out = list(pool.map(work, sessions))
+        for (text, used), s, code, expected in zip(out, sessions, self.roms, self.serial):
+            alone = Session(code, limits={"steps": 10**6})
+            alone.decompile()
+            self.assertEqual(text, expected)
+            self.assertEqual(used, alone.budget.used)
+            self.assertEqual(s.messages, alone.messages)
+
+
+if __name__ == '__main__':
+    unittest.main()
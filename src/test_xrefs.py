@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+import lexer
+import xrefs
+from test_session import rom
+
+
+class IndexTest(unittest.TestCase):
+    def setUp(self):
+        self.db = xrefs.XrefDB.from_tokens(lexer.tokenize_code(rom()))
+
+    def test_kinds(self):
+        self.assertEqual(self.db.callers(0x0600), [0x0150, 0x0804])
+        self.assertEqual(self.db.writers(0xFF40), [0x0802])
+        self.assertEqual(self.db.refs_from(0x0150), [0x0600])
+        self.assertEqual(self.db.refs_to(0x0150, xrefs.XREF_JUMP), [0x0100])
+
+    def test_relative_jumps_by_cpu_address(self):
+        code = bytearray(0x14000)
+        for pc in (0x0200, 0x4000, 0x8000, 0x10000):
+            code[pc:pc+2] = b"\x18\x10"     # jr +$10
+        db = xrefs.XrefDB().index(lexer.tokenize_code(bytes(code)))
+        self.assertEqual(db.refs_from(0x0200), [0x0212])
+        for pc in (0x4000, 0x8000, 0x10000):
+            self.assertEqual(db.refs_from(pc), [0x4012])
+
+    def test_functions(self):
+        self.assertEqual(self.db.funcs_at(0x0150), ["main"])
+        self.assertEqual(self.db.funcs_at(0x0804), ["fun_0800"])
+        self.assertEqual(self.db.funcs_at(0x0900), [])
+        # which functions touch LCDC
+        self.assertEqual(self.db.touching(0xFF40), ["fun_0800"])
+        self.assertEqual(self.db.touching(0x0600, xrefs.XREF_CALL), ["fun_0800", "main"])
+
+    def test_sqlite_same_answers(self):
+        fd, path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        try:
+            self.db.save(path)
+            saved = xrefs.SqliteXrefDB(path)
+            try:
+                for dst in {dst for _, dst, _ in self.db.rows()}:
+                    for kind in (None, xrefs.XREF_CALL, xrefs.XREF_JUMP, xrefs.XREF_WRITE):
+                        self.assertEqual(saved.refs_to(dst, kind), self.db.refs_to(dst, kind))
+                        self.assertEqual(saved.touching(dst, kind), self.db.touching(dst, kind))
+                    self.assertEqual(saved.callers(dst), self.db.callers(dst))
+                    self.assertEqual(saved.readers(dst), self.db.readers(dst))
+                    self.assertEqual(saved.writers(dst), self.db.writers(dst))
+                for src, _, _ in self.db.rows():
+                    self.assertEqual(saved.refs_from(src), sorted(self.db.refs_from(src)))
+                    self.assertEqual(saved.funcs_at(src), self.db.funcs_at(src))
+            finally:
+                saved.close()
+        finally:
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+import sys
+import sqlite3
+import argparse
+from bisect import bisect_right
+import syntax
+import lexer
+import explorer
+
+# kinds of cross references
+XREF_CALL  = "call"
+XREF_JUMP  = "jump"
+XREF_READ  = "read"
+XREF_WRITE = "write"
+XREF_RST   = "rst"
+
+HIGH_PAGE = 0xFF00
+
+
+def classify(inst, pc):
+    # returns (kind, target) for instructions referencing an address, None otherwise.
+    # targets are CPU addresses, sources are ROM offsets.
+    t = type(inst)
+    if t in {syntax.InstCall, syntax.InstConitionalCall}:
+        return XREF_CALL, inst.addr
+    if t in {syntax.InstAbsJump, syntax.InstAbsJumpConditional}:
+        return XREF_JUMP, inst.addr
+    if t in {syntax.InstRelJump, syntax.InstRelJumpConditional}:
+        # relative offsets are counted from the end of the 2-byte JR, as
+        # the CPU sees it: banks above 1 are mapped at $4000
+        return XREF_JUMP, (explorer.cpu_addr(pc) + 2 + inst.addr) & 0xFFFF
+    if t == syntax.InstStoreAddr:
+        return XREF_WRITE, inst.addr
+    if t == syntax.InstLoadAddr:
+        return XREF_READ, inst.addr
+    if t == syntax.InstHighStore:
+        # NOTE: the lexer builds both LDH directions as InstHighStore
+        kind = XREF_READ if "load" in inst.op else XREF_WRITE
+        return kind, HIGH_PAGE | inst.addr
+    if t == syntax.InstReset:
+        return XREF_RST, inst.imm
+    return None
+
+
+class XrefDB:
+    def __init__(self):
+        # target -> [(source, kind)] and source -> [(target, kind)]
+        self._to = {}
+        self._from = {}
+        # [(start, end, name)] of the functions in the call graph, by start
+        self.funcs = []
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        db = cls()
+        db.index(tokens)
+        db.index_funcs(tokens)
+        return db
+
+    def add(self, src, dst, kind):
+        self._to.setdefault(dst, []).append((src, kind))
+        self._from.setdefault(src, []).append((dst, kind))
+
+    def index(self, tokens):
+        # a single pass over the token stream (dict or (pc, inst) pairs)
+        items = tokens.items() if hasattr(tokens, "items") else tokens
+        for pc, inst in items:
+            ref = classify(inst, pc)
+            if ref:
+                kind, dst = ref
+                self.add(pc, dst, kind)
+        return self
+
+    def index_funcs(self, tokens):
+        # the ranges of main and every function reachable from it, to tell
+        # which function a source lies in
+        try:
+            graph = explorer.call_graph(tokens)
+        except (AssertionError, KeyError):
+            # no entry point to start from
+            return self
+        explorer.forget(tokens)
+        main = next(iter(graph))
+        self.funcs = sorted((start, start + length, "main" if start == main else f"fun_{start:04X}")
+                            for start, (length, _) in graph.items())
+        return self
+
+    def funcs_at(self, pc):
+        # names of the functions whose body holds pc, several when they share code
+        i = bisect_right(self.funcs, (pc, float("inf")))
+        return sorted(name for start, end, name in self.funcs[:i] if pc < end)
+
+    def touching(self, addr, kind=None):
+        # names of the functions referencing addr, e.g. touching(0xFF40) for LCDC
+        return sorted({name for src in self.refs_to(addr, kind) for name in self.funcs_at(src)})
+
+    def refs(self, addr):
+        # [(source, kind)] of everything referencing addr
+        return list(self._to.get(addr, []))
+
+    def refs_to(self, addr, kind=None):
+        return [src for src, k in self._to.get(addr, []) if kind is None or k == kind]
+
+    def refs_from(self, pc, kind=None):
+        refs = self._from.get(pc, [])
+        return [dst for dst, k in refs if kind is None or k == kind]
+
+    def callers(self, addr):
+        return self.refs_to(addr, XREF_CALL)
+
+    def readers(self, addr):
+        return self.refs_to(addr, XREF_READ)
+
+    def writers(self, addr):
+        return self.refs_to(addr, XREF_WRITE)
+
+    def targets(self, kinds=(XREF_CALL, XREF_JUMP, XREF_RST)):
+        # sorted index of all referenced addresses of the given kinds
+        return sorted({dst for dst, refs in self._to.items() if any(k in kinds for _, k in refs)})
+
+    def rows(self):
+        for dst, refs in self._to.items():
+            for src, kind in refs:
+                yield src, dst, kind
+
+    def __len__(self):
+        return sum(len(refs) for refs in self._to.values())
+
+    def save(self, path):
+        con = sqlite3.connect(path)
+        with con:
+            con.execute("DROP TABLE IF EXISTS xrefs")
+            con.execute("CREATE TABLE xrefs (src INTEGER, dst INTEGER, kind TEXT)")
+            con.executemany("INSERT INTO xrefs VALUES (?, ?, ?)", self.rows())
+            con.execute("CREATE INDEX xrefs_dst ON xrefs (dst, kind)")
+            con.execute("CREATE INDEX xrefs_src ON xrefs (src, kind)")
+            con.execute("DROP TABLE IF EXISTS funcs")
+            con.execute("CREATE TABLE funcs (lo INTEGER, hi INTEGER, name TEXT)")
+            con.executemany("INSERT INTO funcs VALUES (?, ?, ?)", self.funcs)
+            con.execute("CREATE INDEX funcs_lo ON funcs (lo)")
+        con.close()
+
+
+class SqliteXrefDB:
+    # same lookups as XrefDB, answered from the indexes of a saved file
+    def __init__(self, path):
+        self._con = sqlite3.connect(path)
+
+    def _query(self, col, key, val, kind):
+        sql = f"SELECT {col} FROM xrefs WHERE {key} = ?"
+        args = [val]
+        if kind is not None:
+            sql += " AND kind = ?"
+            args.append(kind)
+        return [row[0] for row in self._con.execute(sql + f" ORDER BY {col}", args)]
+
+    def refs_to(self, addr, kind=None):
+        return self._query("src", "dst", addr, kind)
+
+    def refs_from(self, pc, kind=None):
+        return self._query("dst", "src", pc, kind)
+
+    def callers(self, addr):
+        return self.refs_to(addr, XREF_CALL)
+
+    def readers(self, addr):
+        return self.refs_to(addr, XREF_READ)
+
+    def writers(self, addr):
+        return self.refs_to(addr, XREF_WRITE)
+
+    def funcs_at(self, pc):
+        rows = self._con.execute("SELECT name FROM funcs WHERE lo <= ? AND ? < hi ORDER BY name", (pc, pc))
+        return [row[0] for row in rows]
+
+    def touching(self, addr, kind=None):
+        sql = "SELECT DISTINCT name FROM xrefs JOIN funcs ON lo <= src AND src < hi WHERE dst = ?"
+        args = [addr]
+        if kind is not None:
+            sql += " AND kind = ?"
+            args.append(kind)
+        return [row[0] for row in self._con.execute(sql + " ORDER BY name", args)]
+
+    def close(self):
+        self._con.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="cross references of a gb file")
+    parser.add_argument("gb_file")
+    parser.add_argument("addrs", nargs="*", help="hex addresses to look up, e.g. FF40 or $2F40")
+    parser.add_argument("--db", help="sqlite file to write the xrefs into")
+    parser.add_argument("--kind", choices=[XREF_CALL, XREF_JUMP, XREF_READ, XREF_WRITE, XREF_RST])
+    args = parser.parse_args(argv)
+
+    with open(args.gb_file, "rb") as f:
+        code = f.read()
+
+    db = XrefDB.from_tokens(lexer.index_code(code))
+    if args.db:
+        db.save(args.db)
+        print(f"saved {len(db)} xrefs to {args.db}")
+
+    for addr in args.addrs:
+        addr = int(addr.lstrip("$"), 16)
+        print(f"${addr:04X}:")
+        for src, kind in db.refs(addr):
+            if args.kind is None or kind == args.kind:
+                funcs = db.funcs_at(src)
+                print(f"\t{kind:5} from ${src:04X}" + (f" in {', '.join(funcs)}" if funcs else ""))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))